@@ -0,0 +1,75 @@
+"""
+Load test of many clients on one Loop, against a local MockServer. Reports
+the login time, and the message throughput including echoes from the server.
+
+Usage: python -m benchmarks.load [clients] [messages per client]
+"""
+
+from whatsappy.mock import MockServer
+from whatsappy.callbacks import TextMessageCallback
+from whatsappy import Client, Loop
+
+import json
+import time
+import sys
+
+
+def main(count=100, messages=100):
+    numbers = ["3160%07d" % i for i in xrange(count)]
+
+    server = MockServer(dict((number, "secret") for number in numbers))
+    server.start()
+
+    loop = Loop()
+    clients = []
+    received = [0]
+
+    def on_message(node):
+        received[0] += 1
+
+    # Login
+    start = time.time()
+
+    for number in numbers:
+        client = Client(number, "secret", nickname="Load",
+                        host=server.host, port=server.port)
+        client.register_callback(TextMessageCallback(on_message))
+        client.connect(block=False)
+
+        loop.add(client)
+        clients.append(client)
+
+    while not all(client.account_info for client in clients):
+        loop.run_once(1)
+
+    login = time.time() - start
+
+    # Messages, which are echoed by the server
+    start = time.time()
+
+    for i in xrange(messages):
+        for client in clients:
+            client.message("31612345678", "Message %d" % i)
+
+    while received[0] < count * messages:
+        loop.run_once(1)
+
+    duration = time.time() - start
+
+    for client in clients:
+        loop.remove(client)
+        client.disconnect()
+
+    server.stop()
+
+    print json.dumps({
+        "clients": count,
+        "messages": count * messages,
+        "login_seconds": login,
+        "login_per_second": count / login,
+        "messages_per_second": count * messages / duration
+    }, indent=4, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
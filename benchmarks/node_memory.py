@@ -0,0 +1,122 @@
+"""
+Compare the memory usage of received nodes with the legacy Node class, which
+stored its attributes and children in an instance dictionary.
+
+Usage: python -m benchmarks.node_memory [count]
+"""
+
+from whatsappy.node import Node
+from whatsappy.stream import Reader, Writer
+
+from collections import MutableMapping
+
+import sys
+
+
+class LegacyNode(MutableMapping):
+    """
+    Copy of the Node class before it used slots, reduced to the parts that
+    determine its size.
+    """
+
+    def __init__(self, tag, data=None, children=None, **kwargs):
+        self.name = tag
+        self.data = data
+        self.attributes = kwargs
+        self.children = children or []
+
+    def __iter__(self):
+        return iter(self.attributes)
+
+    def __len__(self):
+        return len(self.attributes)
+
+    def __getitem__(self, key):
+        return self.attributes[key]
+
+    def __setitem__(self, key, value):
+        self.attributes[key] = value
+
+    def __delitem__(self, key):
+        del self.attributes[key]
+
+
+def legacy(node):
+    """
+    Convert a node to a LegacyNode.
+    """
+
+    return LegacyNode(
+        node.name, node.data, [legacy(child) for child in node.children],
+        **node.attributes)
+
+
+def sizeof(node):
+    """
+    Return the size of a node tree in bytes. Strings are not counted, since
+    they are shared by both representations.
+    """
+
+    size = sys.getsizeof(node)
+
+    for name in ("__dict__", "_attributes", "_children"):
+        value = getattr(node, name, None)
+
+        if value is not None:
+            size += sys.getsizeof(value)
+
+    if isinstance(node, LegacyNode):
+        size += sys.getsizeof(node.attributes)
+        size += sys.getsizeof(node.children)
+
+    for child in node.children:
+        size += sizeof(child)
+
+    return size
+
+
+def received_nodes():
+    """
+    Return a list of typical nodes, as decoded by the reader.
+    """
+
+    nodes = [
+        Node("message", to="31612345678@s.whatsapp.net", type="chat",
+             id="message-1400000000-1", t="1400000000", children=[
+                 Node("notify", xmlns="urn:xmpp:whatsapp", name="Name"),
+                 Node("request", xmlns="urn:xmpp:receipts"),
+                 Node("body", "Hello, world!")]),
+        Node("receipt", to="31612345678@s.whatsapp.net",
+             id="message-1400000000-1", t="1400000000"),
+        Node("presence", to="31612345678@s.whatsapp.net", type="available"),
+        Node("iq", id="1", type="result", children=[
+            Node("query", seconds="42")]),
+        Node("ib", children=[Node("dirty", type="groups", timestamp="1")]),
+    ]
+
+    # Decode the nodes, so the benchmark measures what clients keep in memory
+    writer = Writer()
+    reader = Reader()
+
+    for node in nodes:
+        reader.data(writer.node(node)[0])
+
+    return [reader.read()[0] for _ in nodes]
+
+
+def main(count=10000):
+    nodes = received_nodes() * (count // 5)
+
+    current = sum(sizeof(node) for node in nodes)
+    previous = sum(sizeof(legacy(node)) for node in nodes)
+
+    print "Nodes:   %d" % len(nodes)
+    print "Legacy:  %d bytes (%.1f per node)" % (
+        previous, float(previous) / len(nodes))
+    print "Current: %d bytes (%.1f per node)" % (
+        current, float(current) / len(nodes))
+    print "Saved:   %.1f%%" % (100.0 * (previous - current) / previous)
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
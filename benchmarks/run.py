@@ -0,0 +1,306 @@
+"""
+Benchmarks for the protocol codec, encryption and callback dispatch. Every
+benchmark runs on a synthetic corpus, and the results are written as JSON, so
+they can be compared across versions.
+
+Usage: python -m benchmarks.run [-n NUMBER] [-r REPEAT] [-o FILE] [NAME ...]
+
+If names are given, only benchmarks starting with one of them are run.
+"""
+
+from whatsappy.client import Client
+from whatsappy.encryption import Encryption
+from whatsappy.callbacks import Callback, TextMessageCallback, \
+    MediaMessageCallback, ChatStateCallback, PresenceCallback
+from whatsappy.node import Node
+from whatsappy.rc4 import RC4Engine
+from whatsappy.stream import Reader, Writer
+from whatsappy.tokens import str2tok
+
+import argparse
+import platform
+import random
+import timeit
+import json
+import time
+import sys
+
+# Registered benchmarks, in order
+BENCHMARKS = []
+
+# Seed for the synthetic corpus
+SEED = 1417097000
+
+
+def benchmark(name, size=None, scale=1):
+    """
+    Register a benchmark. The decorated function prepares the corpus, and
+    returns the function to time. If 'size' is given, the throughput is
+    reported for that many bytes per call. Slow benchmarks make 'scale' times
+    fewer calls.
+    """
+
+    def decorator(setup):
+        BENCHMARKS.append((name, setup, size, scale))
+        return setup
+    return decorator
+
+
+def message(i=1):
+    return Node(
+        "message", to="31612345678@s.whatsapp.net", type="text",
+        id="message-1417097000-%d" % i, t="1417097000", children=[
+            Node("x", xmlns="jabber:x:event", children=[Node("server")]),
+            Node("notify", xmlns="urn:xmpp:whatsapp", name="Benchmark"),
+            Node("request", xmlns="urn:xmpp:receipts"),
+            Node("body", data="Hello World, this is message %d" % i)])
+
+
+def receipt(i=1):
+    return Node(
+        "receipt", type="read", to="31612345678@s.whatsapp.net",
+        id="message-1417097000-%d" % i, t="1417097000")
+
+
+def incoming(i=1):
+    node = message(i)
+    node["from"] = node.attributes.pop("to")
+    return node
+
+
+def session():
+    """
+    Return a pair of encryption sessions, of which the second one decrypts
+    what the first one encrypts.
+    """
+
+    challenge = "".join(chr(random.randrange(256)) for _ in xrange(20))
+
+    client = Encryption("secret", challenge)
+    server = Encryption("secret", challenge)
+
+    server.rc4_in, server.rc4_out = server.rc4_out, server.rc4_in
+    server.mac_in, server.mac_out = server.mac_out, server.mac_in
+
+    return client, server
+
+
+def payload(size):
+    return "".join(chr(random.randrange(256)) for _ in xrange(size))
+
+
+@benchmark("writer.message")
+def writer_message():
+    writer = Writer()
+    node = message()
+
+    return lambda: writer.node(node)
+
+
+@benchmark("writer.receipt")
+def writer_receipt():
+    writer = Writer()
+    node = receipt()
+
+    return lambda: writer.node(node)
+
+
+@benchmark("writer.encrypted")
+def writer_encrypted():
+    writer = Writer()
+    writer.encrypt = session()[0].encrypt_into
+    node = message()
+
+    return lambda: writer.node(node)
+
+
+@benchmark("reader.plain")
+def reader_plain():
+    buf = Writer().node(incoming())[0]
+
+    def read():
+        reader = Reader()
+        reader.data(buf)
+        reader.read()
+
+    return read
+
+
+@benchmark("reader.encrypted")
+def reader_encrypted():
+    client, server = session()
+
+    writer = Writer()
+    writer.encrypt = client.encrypt_into
+    buf = writer.node(incoming())[0]
+
+    # Rewind the session before every read, so the same frame can be read
+    state = server.rc4_in.state()
+
+    def read():
+        server.rc4_in = RC4Engine.from_state(state)
+        server.read_sequence = 0
+
+        reader = Reader()
+        reader.decrypt = server.decrypt
+        reader.data(buf)
+        reader.read()
+
+    return read
+
+
+@benchmark("rc4.process_bytes.64", size=64)
+def rc4_small():
+    engine = RC4Engine(payload(20))
+    data = payload(64)
+
+    return lambda: engine.process_bytes(data)
+
+
+@benchmark("rc4.process_bytes.16384", size=16384, scale=100)
+def rc4_large():
+    engine = RC4Engine(payload(20))
+    data = payload(16384)
+
+    return lambda: engine.process_bytes(data)
+
+
+@benchmark("encryption.encrypt.64", size=64)
+def encrypt_small():
+    client, _ = session()
+    data = payload(64)
+
+    return lambda: client.encrypt(data)
+
+
+@benchmark("encryption.round_trip.64", size=64)
+def round_trip_small():
+    client, server = session()
+    data = payload(64)
+
+    return lambda: server.decrypt(client.encrypt(data))
+
+
+@benchmark("encryption.round_trip.16384", size=16384, scale=100)
+def round_trip_large():
+    client, server = session()
+    data = payload(16384)
+
+    return lambda: server.decrypt(client.encrypt(data))
+
+
+@benchmark("tokens.str2tok")
+def tokens_str2tok():
+    strings = ["message", "s.whatsapp.net", "receipt", "to", "id", "body",
+               "Hello World", "31612345678", "notify", "urn:xmpp:receipts"]
+
+    def lookup():
+        for string in strings:
+            str2tok(string)
+
+    return lookup
+
+
+def dispatch(count):
+    client = Client("31600000000", "secret")
+    client.auto_receipt = False
+
+    # A mix of callbacks for other stanzas, and for messages that fail a test
+    factories = [
+        lambda: Callback("presence", len),
+        lambda: ChatStateCallback(len),
+        lambda: PresenceCallback(len),
+        lambda: MediaMessageCallback(len),
+        lambda: TextMessageCallback(len, single=False, group=True)]
+
+    for i in xrange(count):
+        client.register_callback(factories[i % len(factories)]())
+
+    # One callback that handles the message
+    client.register_callback(TextMessageCallback(len))
+
+    nodes = [incoming()]
+
+    return lambda: client._handle(nodes)
+
+
+@benchmark("client.dispatch.1")
+def dispatch_1():
+    return dispatch(0)
+
+
+@benchmark("client.dispatch.100")
+def dispatch_100():
+    return dispatch(100)
+
+
+@benchmark("client.dispatch.1000")
+def dispatch_1000():
+    return dispatch(1000)
+
+
+def run(names=None, number=10000, repeat=5):
+    """
+    Run the benchmarks, and return the results as a dictionary.
+    """
+
+    results = {}
+
+    for name, setup, size, scale in BENCHMARKS:
+        if names and not any(name.startswith(prefix) for prefix in names):
+            continue
+
+        calls = max(1, number // scale)
+
+        random.seed(SEED)
+        timings = timeit.Timer(setup()).repeat(repeat, calls)
+
+        best = min(timings) / calls
+        result = {
+            "number": calls,
+            "repeat": repeat,
+            "best": best,
+            "mean": sum(timings) / len(timings) / calls,
+            "ops_per_second": 1.0 / best
+        }
+
+        if size is not None:
+            result["bytes_per_second"] = size / best
+
+        results[name] = result
+
+    return {
+        "time": int(time.time()),
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "machine": platform.machine(),
+        "benchmarks": results
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the benchmarks.")
+    parser.add_argument("names", nargs="*", help="benchmark name prefixes")
+    parser.add_argument("-n", "--number", type=int, default=10000,
+                        help="calls per timing")
+    parser.add_argument("-r", "--repeat", type=int, default=5,
+                        help="number of timings")
+    parser.add_argument("-o", "--output", help="file to write the JSON to")
+    args = parser.parse_args()
+
+    results = run(args.names, args.number, args.repeat)
+    output = json.dumps(results, indent=4, sort_keys=True)
+
+    if args.output:
+        with open(args.output, "w") as fp:
+            fp.write(output + "\n")
+    else:
+        print output
+
+    # Summary for humans
+    for name, result in sorted(results["benchmarks"].iteritems()):
+        sys.stderr.write("%-32s %10.2f us\n" % (name, result["best"] * 1e6))
+
+
+if __name__ == "__main__":
+    main()
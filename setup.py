@@ -8,7 +8,10 @@ setup(
                 "chat protocol.",
     author="Bas Stottelaar",
     py_modules=["whatsappy"],
-    install_requires=["pbkdf2"],
+    # Python 2.7.8 and later derive keys with hashlib
+    extras_require={
+        ':python_full_version < "2.7.8"': ["pbkdf2"],
+    },
     license="MIT",
     test_suite="tests",
     classifiers=[
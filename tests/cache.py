@@ -0,0 +1,69 @@
+from whatsappy.cache import SessionCache
+from whatsappy.encryption import Encryption, AuthBlobEncryption
+
+import unittest
+import tempfile
+import shutil
+import os
+
+SECRET = "secret"
+CHALLENGE = os.urandom(20)
+
+class SessionCacheTest(unittest.TestCase):
+
+    def assertSameSession(self, expected, actual):
+        self.assertEqual(expected.keys, actual.keys)
+        self.assertEqual(expected.encrypt("data"), actual.encrypt("data"))
+        self.assertEqual(expected.rc4_in.state(), actual.rc4_in.state())
+
+    def test_cached(self):
+        """
+        Test if cached sessions equal computed ones
+        """
+
+        cache = SessionCache()
+
+        for cls in (Encryption, AuthBlobEncryption):
+            computed = cls(SECRET, CHALLENGE, cache)
+            cached = cls(SECRET, CHALLENGE, cache)
+
+            self.assertSameSession(cls(SECRET, CHALLENGE), computed)
+            self.assertSameSession(cls(SECRET, CHALLENGE), cached)
+
+        self.assertEqual(2, len(cache))
+
+    def test_eviction(self):
+        """
+        Test if the least recently used session is evicted
+        """
+
+        cache = SessionCache(size=2)
+
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a")
+        cache.put("c", 3)
+
+        self.assertEqual(1, cache.get("a"))
+        self.assertEqual(None, cache.get("b"))
+        self.assertEqual(3, cache.get("c"))
+
+    def test_persistence(self):
+        """
+        Test if a saved cache can be loaded
+        """
+
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, "sessions")
+
+        try:
+            cache = SessionCache(path=path)
+            computed = Encryption(SECRET, CHALLENGE, cache)
+            cache.save()
+
+            cache = SessionCache(path=path)
+            self.assertEqual(1, len(cache))
+            self.assertSameSession(
+                computed, Encryption(SECRET, CHALLENGE, cache))
+        finally:
+            shutil.rmtree(directory)
@@ -1,4 +1,5 @@
 from whatsappy import callbacks
+from whatsappy import Node
 
 import unittest
 
@@ -23,4 +24,57 @@ class CallbackTest(unittest.TestCase):
         callback(2)
 
         self.assertEqual(callback.called, 2)
-        self.assertEqual(callback.result, 2 * 1337)
\ No newline at end of file
+        self.assertEqual(callback.result, 2 * 1337)
+
+    def test_index(self):
+        """
+        Test if the callback index returns the right candidates, most recently
+        added first
+        """
+
+        index = callbacks.CallbackIndex()
+
+        everything = callbacks.Callback("message", None)
+        text = callbacks.TextMessageCallback(None)
+        group = callbacks.TextMessageCallback(None, single=False, group=True)
+        media = callbacks.MediaMessageCallback(None, single=True, group=True)
+
+        index.add(everything)
+        index.add(text)
+        index.add(group)
+        index.add(media)
+
+        node = Node("message", type="text", children=[Node("body")])
+        self.assertEqual([text, everything], index.match(node))
+
+        node["participant"] = "31612345678@s.whatsapp.net"
+        self.assertEqual([group, everything], index.match(node))
+
+        node["type"] = "media"
+        self.assertEqual([media, everything], index.match(node))
+
+        index.remove(everything)
+        self.assertEqual([media], index.match(node))
+        self.assertEqual([], index.match(Node("presence")))
+
+        self.assertRaises(ValueError, index.remove, everything)
+
+    def test_request(self):
+        """
+        Test if a request resolves once, and leaves the pending registry
+        """
+
+        results = []
+        pending = {}
+
+        request = callbacks.Request(
+            "lastseen-1", lambda node: node["seconds"], results.append)
+        request.pending = pending
+        pending[request.id] = request
+
+        request(Node("iq", id="lastseen-1", seconds="42"))
+
+        self.assertEqual(1, request.called)
+        self.assertEqual("42", request.result)
+        self.assertEqual(["42"], results)
+        self.assertEqual({}, pending)
@@ -0,0 +1,225 @@
+from whatsappy.stream import Reader, Writer, MessageIncomplete
+from whatsappy.encryption import Encryption
+from whatsappy.mock import ServerEncryption
+from whatsappy import Client, Node, Loop
+
+import unittest
+import threading
+import socket
+import time
+import os
+
+class Recorder(object):
+    """
+    Socket wrapper that records the size of every write.
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.writes = []
+
+    def send(self, buf):
+        written = self.sock.send(buf)
+        self.writes.append(written)
+
+        return written
+
+    def __getattr__(self, name):
+        return getattr(self.sock, name)
+
+
+class ClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self.local, self.remote = socket.socketpair()
+
+        # Small buffers, so a peer that does not read fills them quickly
+        for sock in (self.local, self.remote):
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4096)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+
+        self.local.setblocking(0)
+
+        self.client = Client("31600000001", "secret", nickname="Test")
+        self.client.socket = Recorder(self.local)
+        self.client.writer = Writer()
+
+        # Only flush when asked to
+        self.client.flush_size = 1 << 20
+        self.client.flush_latency = 60
+
+    def tearDown(self):
+        self.local.close()
+        self.remote.close()
+
+    def receive(self, count, reader=None):
+        """
+        Read frames from the remote end, until 'count' nodes are decoded.
+        """
+
+        reader = reader or Reader()
+        nodes = []
+
+        while len(nodes) < count:
+            buf = self.remote.recv(65536)
+
+            if not buf:
+                break
+
+            reader.data(buf)
+
+            try:
+                while True:
+                    nodes.append(reader.read()[0])
+            except MessageIncomplete:
+                pass
+
+        return nodes
+
+    def test_coalesce(self):
+        """
+        Test if frames are queued, and written in order using one call
+        """
+
+        for index in xrange(3):
+            self.client._write(Node("message", id=str(index)))
+
+        self.assertEqual([], self.client.socket.writes)
+        size = self.client.outbox_size
+
+        self.client.flush()
+
+        self.assertEqual([size], self.client.socket.writes)
+        self.assertEqual(
+            ["0", "1", "2"], [node["id"] for node in self.receive(3)])
+
+    def test_flush_size(self):
+        """
+        Test if the queue is written once it holds at least 'flush_size' bytes
+        """
+
+        self.client.flush_size = 100
+
+        self.client._write(Node("message", id="0", data="x" * 40))
+        self.assertEqual([], self.client.socket.writes)
+
+        self.client._write(Node("message", id="1", data="x" * 60))
+        self.assertEqual(1, len(self.client.socket.writes))
+        self.assertFalse(self.client.outbox)
+
+        self.assertEqual(["0", "1"], [node["id"] for node in self.receive(2)])
+
+    def test_flush_latency(self):
+        """
+        Test if the queue is written when a frame is queued after the oldest
+        one waited 'flush_latency' seconds
+        """
+
+        self.client.flush_latency = 0.01
+
+        self.client._write(Node("message", id="0"))
+        self.assertEqual([], self.client.socket.writes)
+
+        time.sleep(0.02)
+
+        self.client._write(Node("message", id="1"))
+        self.assertEqual(1, len(self.client.socket.writes))
+        self.assertFalse(self.client.outbox)
+
+        self.assertEqual(["0", "1"], [node["id"] for node in self.receive(2)])
+
+    def test_flush_loop(self):
+        """
+        Test if the loop writes the frames queued by a callback using one call
+        """
+
+        loop = Loop()
+        loop.add(self.client)
+
+        def callback():
+            for index in xrange(3):
+                self.client._write(Node("message", id=str(index)))
+
+        loop.call_later(0, callback)
+        loop.run_once(timeout=5)
+
+        self.assertEqual([], self.client.socket.writes)
+
+        loop.run_once(timeout=5)
+
+        self.assertEqual(1, len(self.client.socket.writes))
+        self.assertEqual(
+            ["0", "1", "2"], [node["id"] for node in self.receive(3)])
+
+    def test_encrypted(self):
+        """
+        Test if encrypted frames written in batches are decrypted in order,
+        so their MAC sequence numbers match
+        """
+
+        challenge = os.urandom(20)
+        encryption = Encryption("secret", challenge)
+        self.client.writer.encrypt = encryption.encrypt_into
+
+        reader = Reader()
+        reader.decrypt = ServerEncryption("secret", challenge).decrypt
+
+        for batch in xrange(2):
+            for index in xrange(5):
+                self.client._write(
+                    Node("message", id="%d-%d" % (batch, index)))
+
+            self.client.flush()
+
+        self.assertEqual(2, len(self.client.socket.writes))
+        self.assertEqual(10, encryption.write_sequence)
+        self.assertEqual(
+            ["%d-%d" % (batch, index)
+                for batch in xrange(2) for index in xrange(5)],
+            [node["id"] for node in self.receive(10, reader)])
+
+    def test_nonblocking(self):
+        """
+        Test if a peer that does not read does not block the loop, and if the
+        queued frames are written in order once it reads
+        """
+
+        loop = Loop()
+        loop.add(self.client)
+
+        for index in xrange(64):
+            self.client._write(Node("message", id=str(index), data="x" * 8192))
+
+        # The socket accepts only part of the frames
+        self.client.flush()
+        self.assertTrue(self.client.outbox)
+
+        # Timers still run while the frames wait
+        called = []
+        loop.call_later(0, called.append, 1)
+
+        start = time.time()
+        loop.run_once(timeout=5)
+
+        self.assertEqual([1], called)
+        self.assertLess(time.time() - start, 1)
+
+        # Once the peer reads, the loop writes the rest
+        result = []
+        thread = threading.Thread(
+            target=lambda: result.extend(self.receive(64)))
+        thread.start()
+
+        deadline = time.time() + 5
+
+        while self.client.outbox and time.time() < deadline:
+            loop.run_once(timeout=1)
+
+        thread.join(5)
+
+        self.assertFalse(self.client.outbox)
+        self.assertEqual(0, self.client.outbox_size)
+        self.assertEqual(
+            [str(index) for index in xrange(64)],
+            [node["id"] for node in result])
+        self.assertEqual("x" * 8192, result[-1].data)
@@ -0,0 +1,43 @@
+from whatsappy.encryption import Encryption
+from whatsappy.exceptions import EncryptionError
+
+import unittest
+import os
+
+class EncryptionTest(unittest.TestCase):
+
+    def setUp(self):
+        challenge = os.urandom(20)
+
+        self.client = Encryption("secret", challenge)
+
+        # The server uses the same keys in the opposite direction
+        self.server = Encryption("secret", challenge)
+        self.server.rc4_in, self.server.rc4_out = \
+            self.server.rc4_out, self.server.rc4_in
+        self.server.mac_in, self.server.mac_out = \
+            self.server.mac_out, self.server.mac_in
+
+    def test_round_trip(self):
+        """
+        Test if frames encrypted by one side are decrypted by the other
+        """
+
+        for data in ("", "receipt", os.urandom(4096)):
+            self.assertEqual(
+                data, self.server.decrypt(self.client.encrypt(data)))
+
+        buf = bytearray("\x00data\x00\x00\x00\x00")
+        self.client.encrypt_into(buf, 1, 5)
+        self.assertEqual("data", self.server.decrypt(bytes(buf[1:])))
+
+    def test_mac_mismatch(self):
+        """
+        Test if a modified frame is rejected
+        """
+
+        data = bytearray(self.client.encrypt("receipt"))
+        data[0] ^= 0x01
+
+        with self.assertRaises(EncryptionError):
+            self.server.decrypt(bytes(data))
@@ -0,0 +1,31 @@
+from whatsappy import kdf
+
+import unittest
+import os
+
+class KDFTest(unittest.TestCase):
+
+    @unittest.skipIf(kdf.PBKDF2 is None or kdf.pbkdf2_hmac is None,
+                     "Requires both backends")
+    def test_backends(self):
+        """
+        Test if both backends derive the same keys
+        """
+
+        for iterations in (1, 2, 16):
+            for length in (1, 20, 40):
+                secret = os.urandom(20)
+                salt = os.urandom(20)
+
+                self.assertEqual(
+                    kdf.pbkdf2_package(secret, salt, iterations, length),
+                    kdf.pbkdf2_hashlib(secret, salt, iterations, length))
+
+    def test_vector(self):
+        """
+        Test the preferred backend with a vector from RFC 6070
+        """
+
+        self.assertEqual(
+            "4b007901b765489abead49d926f721d065a429c1",
+            kdf.pbkdf2("password", "salt", 4096, 20).encode("hex"))
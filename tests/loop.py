@@ -0,0 +1,135 @@
+from whatsappy.loop import Loop
+from whatsappy.callbacks import Callback
+from whatsappy.exceptions import TimeoutError
+from whatsappy import Client
+
+import unittest
+import threading
+import time
+import os
+
+class LoopTest(unittest.TestCase):
+
+    def test_call_later(self):
+        """
+        Test if timers run in order of their deadline, and cancelled ones do
+        not run
+        """
+
+        loop = Loop()
+        called = []
+
+        loop.call_later(0.03, called.append, 3)
+        loop.call_later(0.01, called.append, 1)
+        loop.call_later(0.02, called.append, 2).cancel()
+        loop.call_later(0, called.append, 0)
+
+        deadline = time.time() + 1
+
+        while len(called) < 3 and time.time() < deadline:
+            loop.run_once()
+
+        self.assertEqual([0, 1, 3], called)
+        self.assertFalse(loop.timers)
+
+    def test_call_soon_threadsafe(self):
+        """
+        Test if another thread can wake up a waiting loop
+        """
+
+        loop = Loop()
+        called = []
+
+        thread = threading.Thread(
+            target=lambda: loop.call_soon_threadsafe(called.append, 1))
+
+        start = time.time()
+        thread.start()
+        loop.run_once(timeout=5)
+        thread.join()
+
+        self.assertEqual([1], called)
+        self.assertLess(time.time() - start, 5)
+
+    def test_wait_for_callback(self):
+        """
+        Test if waiting for a callback that is not called times out
+        """
+
+        client = Client("31600000001", "secret")
+        Loop().add(client)
+
+        callback = Callback("message", None)
+
+        start = time.time()
+
+        with self.assertRaises(TimeoutError):
+            client.register_callback_and_wait(callback, timeout=0.05)
+
+        self.assertGreaterEqual(time.time() - start, 0.05)
+        self.assertFalse(callback in client.callbacks)
+
+        # Callbacks called before the timeout return their result
+        callback = Callback("message", lambda node: "result")
+        client.loop.call_later(0.01, callback, None)
+
+        self.assertEqual(
+            "result", client.register_callback_and_wait(callback, timeout=5))
+
+    def test_reader_failed(self):
+        """
+        Test if a failing reader does not stop other callbacks when 'on_error'
+        is set, and is raised otherwise
+        """
+
+        errors = []
+        loop = Loop(on_error=lambda client, e: errors.append((client, e)))
+        called = []
+
+        def fail():
+            raise ValueError("reader")
+
+        read, write = os.pipe()
+        reader = os.fdopen(read, "rb", 0)
+        os.write(write, "\x00")
+
+        loop.add_reader(reader, fail)
+        loop.call_later(0, called.append, 1)
+        loop.run_once(timeout=5)
+
+        self.assertEqual([1], called)
+        self.assertEqual([], errors)
+
+        # The pipe is still readable
+        loop.on_error = None
+
+        with self.assertRaises(ValueError):
+            loop.run_once(timeout=5)
+
+        reader.close()
+        os.close(write)
+
+    def test_client_failed(self):
+        """
+        Test if any exception of a client method removes only that client, and
+        is passed to 'on_error'
+        """
+
+        class FailingClient(Client):
+            def keepalive(self):
+                raise ValueError("client")
+
+        errors = []
+        loop = Loop(on_error=lambda client, e: errors.append((client, e)))
+
+        client = FailingClient("31600000001", "secret")
+        other = Client("31600000002", "secret")
+        loop.add(client)
+        loop.add(other)
+
+        loop.call_later(0, client.keepalive)
+        loop.run_once(timeout=5)
+
+        self.assertEqual([other], loop.clients)
+        self.assertEqual(client, errors[0][0])
+        self.assertIsInstance(errors[0][1], ValueError)
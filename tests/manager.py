@@ -0,0 +1,137 @@
+from whatsappy.manager import HashRing, Manager
+from whatsappy.mock import MockServer
+from whatsappy.exceptions import Error
+
+import unittest
+import time
+
+SECRET = "secret"
+
+class HashRingTest(unittest.TestCase):
+    def test_consistent(self):
+        """
+        Test if adding a node to the ring only moves keys to that node
+        """
+
+        ring = HashRing(range(4))
+        keys = ["3161234%04d" % i for i in range(1000)]
+        before = dict((key, ring.get(key)) for key in keys)
+
+        ring.add(4)
+
+        for key in keys:
+            self.assertTrue(ring.get(key) in (before[key], 4))
+
+        ring.remove(4)
+
+        for key in keys:
+            self.assertEqual(before[key], ring.get(key))
+
+class ManagerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.errors = []
+        self.manager = Manager(
+            workers=2,
+            on_error=lambda number, error: self.errors.append(number))
+
+        self.numbers = ["316%08d" % i for i in xrange(6)]
+        self.server = MockServer(dict(
+            (number, SECRET) for number in self.numbers)).start()
+
+        for number in self.numbers:
+            self.manager.add_account(
+                number, SECRET, nickname="Test", host=self.server.host,
+                port=self.server.port)
+
+    def tearDown(self):
+        self.manager.stop()
+        self.server.stop()
+
+    def wait_for_logins(self):
+        deadline = time.time() + 5
+
+        while sum(stats["connected"] for stats in self.manager.stats() if
+                  stats) < len(self.manager.accounts):
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.01)
+
+    def test_call(self):
+        """
+        Test if client methods are called in the worker of the account
+        """
+
+        self.wait_for_logins()
+
+        for number in self.numbers:
+            self.assertEqual(
+                0, self.manager.call(number, "last_seen", "31612345678"))
+
+        self.assertEqual(
+            len(self.numbers), sum(
+                stats["accounts"] for stats in self.manager.stats()))
+
+    def test_unpicklable(self):
+        """
+        Test if a result that cannot be sent to the manager is returned as
+        an error, and the worker survives
+        """
+
+        self.wait_for_logins()
+        number = self.numbers[0]
+
+        # Broadcasts return a delivery tracker
+        with self.assertRaises(Error):
+            self.manager.call(number, "broadcast", ["31612345678"], "Hello")
+
+        self.assertEqual(0, self.manager.call(
+            number, "last_seen", "31612345678"))
+        self.assertFalse(self.manager.dead)
+
+    def test_call_failed(self):
+        """
+        Test if exceptions of client methods are raised by call, and the
+        worker survives
+        """
+
+        self.wait_for_logins()
+        number = self.numbers[0]
+
+        with self.assertRaises(ValueError):
+            self.manager.call(number, "chatstate", "31612345678", "bogus")
+        with self.assertRaises(AttributeError):
+            self.manager.call(number, "unknown")
+        with self.assertRaises(TypeError):
+            self.manager.call(number, "last_seen")
+
+        self.assertEqual(0, self.manager.call(
+            number, "last_seen", "31612345678"))
+        self.assertFalse(self.manager.dead)
+
+    def test_worker_died(self):
+        """
+        Test if the accounts of a worker that died are reported
+        """
+
+        self.wait_for_logins()
+
+        index = self.manager.worker(self.numbers[0])
+        lost = set(
+            number for number in self.numbers
+            if self.manager.worker(number) == index)
+
+        self.manager.workers[index].terminate()
+        self.manager.workers[index].join()
+
+        deadline = time.time() + 5
+
+        while set(self.errors) != lost:
+            self.assertLess(time.time(), deadline)
+            self.manager.poll(timeout=0.1)
+
+        self.assertEqual({index}, self.manager.dead)
+        self.assertIsNone(self.manager.stats()[index])
+        self.assertFalse(lost & set(self.manager.accounts))
+
+        # New accounts are assigned to the remaining worker
+        self.assertNotEqual(index, self.manager.worker(self.numbers[0]))
@@ -0,0 +1,333 @@
+from whatsappy.mock import MockServer
+from whatsappy.exceptions import LoginError, StreamError, TimeoutError, \
+    ConnectionError
+from whatsappy.callbacks import Callback, TextMessageCallback
+from whatsappy import Client, Node, Loop, SessionCache
+
+import unittest
+import threading
+import socket
+
+NUMBER = "31600000001"
+SECRET = "secret"
+
+class MockServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = MockServer({NUMBER: SECRET, "31600000002": SECRET})
+        self.server.start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def client(self, number=NUMBER, secret=SECRET):
+        return Client(number, secret, nickname="Test",
+                      host=self.server.host, port=self.server.port)
+
+    def test_login(self):
+        """
+        Test logging in, and a request
+        """
+
+        client = self.client()
+        client.connect()
+
+        self.assertEqual("active", client.account_info["status"])
+        self.assertEqual(0, client.last_seen("31612345678", timeout=5))
+
+        client.disconnect()
+
+    def test_login_failed(self):
+        """
+        Test logging in with a wrong secret
+        """
+
+        client = self.client(secret="wrong")
+
+        with self.assertRaises(LoginError):
+            client.connect()
+
+    def test_echo(self):
+        """
+        Test if messages are echoed
+        """
+
+        client = self.client()
+        client.connect()
+        client.message("31612345678", "Hello World")
+
+        node = client.register_callback_and_wait(
+            TextMessageCallback(lambda node: node), timeout=5)
+
+        self.assertEqual("31612345678@s.whatsapp.net", node["from"])
+        self.assertEqual("Hello World", node.child("body").data)
+
+        client.disconnect()
+
+    def test_backlog(self):
+        """
+        Test if queued messages are delivered after login
+        """
+
+        self.server.queue(NUMBER, Node(
+            "message", type="text", id="offline-1",
+            children=[Node("body", data="Offline")],
+            **{"from": "31612345678@s.whatsapp.net"}))
+
+        client = self.client()
+        received = []
+        client.register_callback(
+            Callback("message", lambda node: received.append(node)))
+        client.connect()
+        client._run_until(lambda: received, timeout=5)
+
+        self.assertEqual("Offline", received[0].child("body").data)
+        self.assertTrue(received[0].has_child("offline"))
+
+        client.disconnect()
+
+    def test_broadcast(self):
+        """
+        Test if a broadcast is delivered to every recipient
+        """
+
+        numbers = ["316%08d" % i for i in xrange(50)]
+        delivered = []
+
+        client = self.client()
+        client.connect()
+
+        msgids, tracker = client.broadcast(
+            numbers + numbers[:10], "Hello World",
+            lambda number, node: delivered.append(number))
+        client._run_until(lambda: tracker.done, timeout=5)
+
+        self.assertEqual(set(numbers), set(msgids))
+        self.assertEqual(sorted(numbers), sorted(delivered))
+        self.assertFalse(tracker.pending)
+        self.assertFalse(tracker in client.callbacks)
+
+        client.disconnect()
+
+    def test_reconnect(self):
+        """
+        Test if a lost connection is resumed with the auth blob, and stanzas
+        sent in the meantime are delivered
+        """
+
+        client = self.client()
+        client.auto_reconnect = True
+        client.reconnect_delay = 0.01
+        client.session_cache = SessionCache()
+        client.connect()
+
+        self.server.disconnect(NUMBER)
+        client._run_until(lambda: client.reconnecting, timeout=5)
+
+        received = []
+        results = []
+
+        client.register_callback(TextMessageCallback(received.append))
+        client.message("31612345678", "Hello World")
+        client.last_seen("31612345678", callback=results.append)
+
+        client._run_until(lambda: received and results, timeout=5)
+
+        self.assertEqual("Hello World", received[0].child("body").data)
+        self.assertEqual([0], results)
+        self.assertEqual(2, self.server.logins)
+        self.assertEqual(1, self.server.resumes)
+        self.assertFalse(client.reconnecting)
+
+        # Both logins derive the keys of their auth blob, so the reconnect
+        # hits the cache, and only the keys of the next login are kept
+        cache = client.session_cache
+        key = cache.key("AuthBlobEncryption", SECRET, client.auth_blob)
+
+        self.assertEqual((1, 2), (cache.hits, cache.misses))
+        self.assertEqual([key], cache.entries.keys())
+
+        client.disconnect()
+
+    def test_sync(self):
+        """
+        Test if a sync is split into chunks, and their results are merged
+        """
+
+        client = self.client()
+        client.connect()
+
+        sent = []
+        send = client._send
+        client._send = lambda node: (sent.append(node), send(node))
+
+        streams = []
+        read = client.reader.read
+        client.reader.read = lambda copy_plain, stream: (
+            streams.append(stream), read(copy_plain, stream))[1]
+
+        numbers = ["+316%08d" % i for i in xrange(25)]
+        result = client.sync_contacts(
+            numbers + ["316 0000 0000", "31600000001"], chunk_size=10,
+            timeout=5)
+
+        syncs = [node.child("sync") for node in sent]
+
+        self.assertEqual(["0", "1", "2"], [sync["index"] for sync in syncs])
+        self.assertEqual(
+            ["false", "false", "true"], [sync["last"] for sync in syncs])
+        self.assertEqual(1, len(set(sync["sid"] for sync in syncs)))
+        self.assertEqual([10, 10, 5], [
+            len(sync.children_by_name("user")) for sync in syncs])
+
+        self.assertEqual(["in"], result.keys())
+        self.assertEqual(numbers, [user.data for user in result["in"]])
+
+        # The users of every chunk are streamed
+        self.assertEqual(3, len(filter(None, streams)))
+        self.assertEqual({}, client.streams)
+
+        with self.assertRaises(ValueError):
+            client.sync_contacts(numbers, chunk_size=0)
+
+        client.disconnect()
+
+    def test_sync_failed(self):
+        """
+        Test if a failed or timed out chunk fails the whole sync
+        """
+
+        client = self.client()
+        client.connect()
+
+        numbers = ["+316%08d" % i for i in xrange(25)]
+        error = Node("iq", type="error", children=[
+            Node("error", children=[Node("bad-request")])])
+
+        for resolve, expected in (
+                (lambda request: request(error), StreamError),
+                (lambda request: request.resolve(TimeoutError()),
+                 TimeoutError)):
+            results = []
+            before = set(client.requests)
+
+            client.sync_contacts(
+                numbers, chunk_size=10, callback=results.append)
+            chunks = set(client.requests) - before
+
+            # Fail one chunk, before any response is received
+            resolve(client.requests[min(chunks)])
+
+            self.assertEqual(1, len(results))
+            self.assertIsInstance(results[0], expected)
+
+            # The other chunks are no longer pending
+            self.assertFalse(set(client.requests) & chunks)
+
+        client.disconnect()
+
+    def test_reconnect_unpaced(self):
+        """
+        Test if stanzas written while reconnecting are sent after the login,
+        without a scheduler
+        """
+
+        client = self.client()
+        client.scheduler = None
+        client.auto_reconnect = True
+        client.reconnect_delay = 0.01
+        client.connect()
+
+        self.server.disconnect(NUMBER)
+        client._run_until(lambda: client.reconnecting, timeout=5)
+
+        received = []
+        results = []
+
+        client.register_callback(TextMessageCallback(received.append))
+        client._receipt(Node(
+            "message", id="offline-1",
+            **{"from": "31612345678@s.whatsapp.net"}))
+        client.message("31612345678", "Hello World")
+        client.last_seen("31612345678", callback=results.append)
+
+        client._run_until(lambda: received and results, timeout=5)
+
+        self.assertEqual("Hello World", received[0].child("body").data)
+        self.assertEqual([0], results)
+        self.assertEqual(1, self.server.counts["receipt"])
+        self.assertFalse(client.replay)
+
+        client.disconnect()
+
+    def test_connect_interrupted(self):
+        """
+        Test if a login can be retried after the connection is lost during a
+        blocking login
+        """
+
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind(("127.0.0.1", 0))
+        listener.listen(2)
+
+        def close():
+            for _ in xrange(2):
+                listener.accept()[0].close()
+
+        thread = threading.Thread(target=close)
+        thread.start()
+
+        client = Client(
+            NUMBER, SECRET, host="127.0.0.1", port=listener.getsockname()[1])
+
+        for _ in xrange(2):
+            with self.assertRaises(ConnectionError):
+                client.connect()
+
+        thread.join()
+        listener.close()
+
+    def test_connect_nonblocking(self):
+        """
+        Test if a connection is completed in the background
+        """
+
+        client = self.client()
+        loop = Loop()
+
+        client.connect(block=False)
+        loop.add(client)
+
+        client._run_until(lambda: client.account_info is not None, timeout=5)
+        self.assertFalse(client.connecting)
+
+        client.disconnect()
+
+    def test_connect_nonblocking_failed(self):
+        """
+        Test if a failed connection in the background raises an error from
+        the loop
+        """
+
+        # Nothing listens on a bound socket
+        closed = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        closed.bind(("127.0.0.1", 0))
+
+        client = Client(
+            NUMBER, SECRET, host="127.0.0.1", port=closed.getsockname()[1])
+        errors = []
+        loop = Loop(on_error=lambda client, error: errors.append(error))
+
+        try:
+            client.connect(block=False)
+        except ConnectionError as e:
+            errors.append(e)
+        else:
+            loop.add(client)
+            loop.run()
+
+        closed.close()
+
+        self.assertEqual(1, len(errors))
+        self.assertIsInstance(errors[0], ConnectionError)
+        self.assertIsNone(client.socket)
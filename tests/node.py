@@ -1,5 +1,6 @@
 from whatsappy import Node
 
+import pickle
 import unittest
 
 class NodeTest(unittest.TestCase):
@@ -78,4 +79,97 @@ class NodeTest(unittest.TestCase):
         self.assertEqual(1, len(node))
 
         for key in node: # Test iterator
-            self.assertEqual("attr1", key)
\ No newline at end of file
+            self.assertEqual("attr1", key)
+
+    def test_pickle(self):
+        """
+        Test if nodes survive pickling, as done by the manager
+        """
+
+        node = Node("name", "data", children=[Node("child", attr1="value1")])
+        node = pickle.loads(pickle.dumps(node, 2))
+
+        self.assertEqual("data", node.data)
+        self.assertEqual("value1", node.child("child")["attr1"])
+        self.assertEqual([], node.child("child").children)
+
+    def test_lazy(self):
+        """
+        Test if nodes without attributes or children behave as empty ones
+        """
+
+        node = Node("name")
+
+        self.assertEqual(0, len(node))
+        self.assertEqual(None, node.get("attr1"))
+        self.assertFalse("attr1" in node)
+        self.assertRaises(KeyError, lambda: node["attr1"])
+
+        # Reading without the properties does not allocate
+        self.assertIsNone(node.first_child())
+        self.assertEqual([], list(node.iter_children()))
+        self.assertEqual((None, None), (node._attributes, node._children))
+
+        node.children.append(Node("child"))
+        self.assertTrue(node.has_child("child"))
+        self.assertEqual("child", node.first_child().name)
+
+        # A single child without attributes
+        node = Node("x", children=Node("server"))
+        self.assertEqual(["server"], [child.name for child in node.children])
+
+    def test_index(self):
+        """
+        Test child lookups on nodes with many children
+        """
+
+        node = Node("sync", children=[
+            Node("user", data=str(i)) for i in xrange(100)])
+        node.add(Node("out"))
+
+        self.assertEqual("0", node.child("user").data)
+        self.assertEqual(100, len(node.children_by_name("user")))
+        self.assertTrue(node.has_child("out"))
+        self.assertFalse(node.has_child("in"))
+
+        # Changes via add and remove, and directly to the list
+        node.add(Node("in"))
+        node.remove(node.child("out"))
+        self.assertTrue(node.has_child("in"))
+        self.assertFalse(node.has_child("out"))
+
+        node.children.append(Node("out"))
+        self.assertTrue(node.has_child("out"))
+
+        node.children = node.children[:2]
+        self.assertEqual(["0", "1"], [
+            child.data for child in node.children_by_name("user")])
+
+    def test_index_mutations(self):
+        """
+        Test if lookups see changes to the list of children that keep its
+        length
+        """
+
+        node = Node("sync", children=[
+            Node("user", data=str(i)) for i in xrange(10)])
+        node.add(Node("out", data="old"))
+
+        self.assertEqual("old", node.child("out").data)
+        self.assertEqual("0", node.child("user").data)
+
+        node.children[10] = Node("out", data="new")
+        self.assertEqual("new", node.child("out").data)
+
+        node.children.reverse()
+        self.assertEqual("9", node.child("user").data)
+
+        node.children.insert(0, Node("in"))
+        node.children.pop()
+        self.assertTrue(node.has_child("in"))
+        self.assertEqual(9, len(node.children_by_name("user")))
+
+        node.children.sort(key=lambda child: child.data)
+        self.assertEqual(
+            [str(i) for i in xrange(1, 10)],
+            [child.data for child in node.children_by_name("user")])
@@ -47,3 +47,17 @@ class RC4Test(unittest.TestCase):
         self.assertEqual(a.process_bytes(b.process_bytes(message)), message,
             "encryption is reversible")
         self.assertEqual(a.box, b.box)
+
+    def test_skip(self):
+        """
+        Test if skipping bytes is equivalent to processing and discarding them.
+        """
+        a = RC4Engine(KEY)
+        b = RC4Engine(KEY)
+
+        a.process_bytes("\0" * 768)
+        b.skip(768)
+        self.assertEqual(a.box, b.box)
+
+        message = os.urandom(128)
+        self.assertEqual(a.process_bytes(message), b.process_bytes(message))
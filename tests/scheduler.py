@@ -0,0 +1,109 @@
+from whatsappy.scheduler import Scheduler, priority, throttled, HIGH, NORMAL, \
+    LOW, SLOW_ACK
+from whatsappy.node import Node
+from whatsappy import Client
+
+import unittest
+
+class SchedulerTest(unittest.TestCase):
+
+    def test_burst(self):
+        """
+        Test if no more than 'burst' stanzas are sent at once
+        """
+
+        scheduler = Scheduler(rate=1, burst=3)
+
+        for i in xrange(5):
+            scheduler.push(Node("message", id=str(i)), LOW)
+
+        sent = []
+
+        while True:
+            node = scheduler.pop()
+
+            if node is None:
+                break
+            sent.append(node["id"])
+
+        self.assertEqual(["0", "1", "2"], sent)
+        self.assertEqual(2, len(scheduler))
+        self.assertTrue(0 < scheduler.delay() <= 1)
+
+    def test_priority(self):
+        """
+        Test if stanzas are sent by priority, and in order within a priority
+        """
+
+        scheduler = Scheduler()
+
+        scheduler.push(Node("message", id="1"), LOW)
+        scheduler.push(Node("iq", id="2", type="get"), NORMAL)
+        scheduler.push(Node("message", id="3"), LOW)
+        scheduler.push(Node("iq", id="4", type="set"), NORMAL)
+
+        self.assertEqual({NORMAL: 2, LOW: 2}, scheduler.depths())
+        self.assertEqual(
+            ["2", "4", "1", "3"], [scheduler.pop()["id"] for _ in xrange(4)])
+        self.assertIsNone(scheduler.pop())
+        self.assertIsNone(scheduler.delay())
+
+        self.assertEqual(HIGH, priority(Node("receipt")))
+        self.assertEqual(HIGH, priority(Node("iq", type="result")))
+        self.assertEqual(NORMAL, priority(Node("iq", type="get")))
+        self.assertEqual(LOW, priority(Node("message")))
+
+    def test_adaptive(self):
+        """
+        Test if the rate increases on acknowledgements, and decreases on errors
+        and slow acknowledgements
+        """
+
+        scheduler = Scheduler(rate=10, min_rate=5, max_rate=11)
+
+        for i in xrange(3):
+            scheduler.push(Node("message", id=str(i)), LOW)
+            scheduler.pop()
+
+        scheduler.acknowledged("0")
+        self.assertEqual(11, scheduler.rate)
+
+        scheduler.acknowledged("1")
+        self.assertEqual(11, scheduler.rate)
+
+        # Unknown and repeated acknowledgements are ignored
+        scheduler.acknowledged("0")
+        scheduler.acknowledged("unknown")
+        self.assertEqual(11, scheduler.rate)
+
+        scheduler.sent["2"] -= SLOW_ACK + 1
+        scheduler.acknowledged("2")
+        self.assertEqual(5.5, scheduler.rate)
+
+        scheduler.backoff()
+        self.assertEqual(5, scheduler.rate)
+        self.assertEqual(2, scheduler.backoffs)
+
+    def test_throttled(self):
+        """
+        Test if only throttling errors decrease the rate of a client
+        """
+
+        def error(**attributes):
+            return Node("iq", type="error", id="lastseen-1", children=[
+                Node("error", **attributes)])
+
+        self.assertFalse(throttled(error(code="404", text="item-not-found")))
+        self.assertFalse(throttled(Node("iq", type="result")))
+        self.assertTrue(throttled(error(code="429")))
+        self.assertTrue(throttled(error(text="rate-overlimit")))
+        self.assertTrue(throttled(Node("stream:error")))
+
+        client = Client("31600000001", "secret")
+        rate = client.scheduler.rate
+
+        client._handle([error(code="403"), error(code="404")])
+        self.assertEqual(rate, client.scheduler.rate)
+
+        client._handle([error(code="429", text="rate-overlimit")])
+        self.assertEqual(rate / 2, client.scheduler.rate)
@@ -0,0 +1,223 @@
+from whatsappy.stream import Reader, Writer, Template, MessageIncomplete
+from whatsappy.encryption import Encryption
+from whatsappy.mock import ServerEncryption
+from whatsappy.tokens import TOKENS
+from whatsappy import Node
+
+import unittest
+import os
+
+class StreamTest(unittest.TestCase):
+    def setUp(self):
+        self.node = Node(
+            "message", to="31612345678@s.whatsapp.net", type="text",
+            id="message-1417097000-1", t="1417097000",
+            children=[Node("body", data="Hello World")])
+
+    def assertNodeEqual(self, expected, actual):
+        self.assertEqual(expected.to_xml(), actual.to_xml())
+
+    def test_round_trip(self):
+        """
+        Test if a node survives writing and reading it back
+        """
+
+        buf, plain = Writer().node(self.node)
+
+        reader = Reader()
+        reader.data(buf)
+        node, read_plain = reader.read(copy_plain=True)
+
+        self.assertNodeEqual(self.node, node)
+        self.assertEqual(plain, read_plain)
+
+    def test_reserved_attributes(self):
+        """
+        Test if attributes named like arguments of Node survive a round trip
+        """
+
+        node = Node("iq", id="1", children=[Node("query")])
+        node.update(data="x", tag="y", children="z")
+
+        for read in (
+                lambda reader: reader.read()[0],
+                lambda reader: next(reader.iter_children("iq"))[0]):
+            reader = Reader()
+            reader.data(Writer().node(node)[0])
+
+            self.assertEqual(
+                {"id": "1", "data": "x", "tag": "y", "children": "z"},
+                dict(read(reader).items()))
+
+        template = Template(node)
+        self.assertEqual("x", template["data"])
+        self.assertEqual(node.to_xml(), template.to_xml())
+
+    def test_incomplete(self):
+        """
+        Test if the reader waits for more data, feeding it byte per byte
+        """
+
+        buf, _ = Writer().node(self.node)
+        reader = Reader()
+
+        for i in range(len(buf) - 1):
+            reader.data(buf[i:i + 1])
+            self.assertRaises(MessageIncomplete, reader.read)
+
+        reader.data(buf[-1:])
+        node, _ = reader.read()
+
+        self.assertNodeEqual(self.node, node)
+        self.assertRaises(MessageIncomplete, reader.read)
+
+    def test_multiple(self):
+        """
+        Test if consecutive nodes in one buffer are read one after another,
+        while the buffer is compacted in between
+        """
+
+        buf, _ = Writer().node(self.node)
+        reader = Reader()
+
+        for _ in range(10):
+            reader.data(buf * 3)
+
+            for _ in range(3):
+                node, _ = reader.read()
+                self.assertNodeEqual(self.node, node)
+
+            self.assertRaises(MessageIncomplete, reader.read)
+            self.assertTrue(len(reader.buf) <= len(buf) * 3)
+
+    def test_tokens(self):
+        """
+        Test if every token in the dictionary can be written and read back
+        """
+
+        writer = Writer()
+
+        for token in TOKENS:
+            buf, _ = writer.node(Node(token or "name", attr=token))
+
+            reader = Reader()
+            reader.data(buf)
+            node, _ = reader.read()
+
+            self.assertEqual(token or "name", node.name)
+            self.assertEqual(token, node["attr"])
+
+    def test_iter_children(self):
+        """
+        Test if children of a named element are streamed, in order
+        """
+
+        users = [Node("user", data="+3161234567%d" % i) for i in xrange(10)]
+        node = Node("iq", id="sync-1", type="result", children=[
+            Node("sync", index="0", children=[Node("in", children=users)]),
+            Node("result")])
+
+        buf, _ = Writer().node(node)
+        reader = Reader()
+        reader.data(buf)
+
+        streamed = []
+
+        for root, child in reader.iter_children("in"):
+            self.assertEqual("sync-1", root["id"])
+            streamed.append(child)
+
+        self.assertEqual([user.data for user in users], [
+            child.data for child in streamed])
+
+        # Elements after the streamed ones are decoded as usual
+        self.assertTrue(root.has_child("result"))
+        self.assertEqual([], root.child("sync").child("in").children)
+
+    def test_peek(self):
+        """
+        Test if peeking does not consume plain or encrypted frames, and if
+        frames with another root element are left to be read
+        """
+
+        challenge = os.urandom(20)
+        server = ServerEncryption("secret", challenge)
+        receipt = Node("receipt", id="1")
+        users = [Node("user", data="+3161234567%d" % i) for i in xrange(3)]
+        sync = Node("iq", id="sync-1", type="result", children=[
+            Node("sync", children=[
+                Node("in", children=users[:2]), Node("out", children=users[2:])])])
+
+        for encrypt in (None, server.encrypt_into):
+            writer = Writer()
+            writer.encrypt = encrypt
+
+            reader = Reader()
+            reader.decrypt = Encryption("secret", challenge).decrypt
+
+            for node in (receipt, sync, receipt):
+                reader.data(writer.node(node)[0])
+
+            self.assertEqual("receipt", reader.peek().name)
+            self.assertEqual("1", reader.peek()["id"])
+
+            # The receipt is not consumed by iterating another element
+            self.assertEqual([], list(reader.iter_children("in", "iq")))
+            self.assertNodeEqual(receipt, reader.read()[0])
+
+            # Children are passed to the callback with their parent
+            streamed = []
+            header = reader.peek()
+            node, _ = reader.read(stream=(
+                ("in", "out"), lambda parent, child: streamed.append(
+                    (parent.name, child.data))))
+
+            self.assertEqual("sync-1", header["id"])
+            self.assertFalse(header.children)
+            self.assertEqual(
+                [("in", users[0].data), ("in", users[1].data),
+                 ("out", users[2].data)], streamed)
+            self.assertEqual(
+                ["in", "out"],
+                [child.name for child in node.child("sync").children])
+            self.assertFalse(node.child("sync").child("in").children)
+
+            self.assertNodeEqual(receipt, reader.read()[0])
+
+            with self.assertRaises(MessageIncomplete):
+                reader.peek()
+
+    def test_nibbles(self):
+        """
+        Test if numeric strings are packed into nibbles, and read back
+        """
+
+        for value in ("31612345678", "1417097000", "1-2.3", "0" * 254):
+            node = Node("iq", id=value, to=value + "@s.whatsapp.net")
+            buf, plain = Writer().node(node)
+
+            self.assertTrue("\xFF" in plain)
+            self.assertFalse(value in plain)
+
+            reader = Reader()
+            reader.data(buf)
+            self.assertNodeEqual(node, reader.read()[0])
+
+        # Too long, or not numeric
+        for value in ("0" * 255, "+31612345678", u"123"):
+            buf, plain = Writer().node(Node("iq", id=value))
+            self.assertTrue(str(value) in plain)
+
+    def test_template(self):
+        """
+        Test if templates are written like the nodes they are made of
+        """
+
+        request = Node("request", xmlns="urn:xmpp:receipts")
+        node = Node("message", id="1", children=[request, Node("body", "Hi")])
+        expected = Writer().node(node)[0]
+
+        node.children[0] = Template(request)
+        self.assertEqual(expected, Writer().node(node)[0])
+        self.assertTrue(node.has_child("request"))
+        self.assertEqual(request.to_xml(), node.children[0].to_xml())
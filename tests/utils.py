@@ -0,0 +1,17 @@
+from whatsappy import utils
+
+import unittest
+
+class UtilsTest(unittest.TestCase):
+
+    def test_normalize_numbers(self):
+        """
+        Test if numbers are formatted, and deduplicated in order
+        """
+
+        numbers = utils.normalize_numbers([
+            "+31 6 1234-5678", "(0031) 612345679", "31612345678", "", "-",
+            "316.1234.5679", "31612345680"])
+
+        self.assertEqual(
+            ["+31612345678", "+31612345679", "+31612345680"], numbers)
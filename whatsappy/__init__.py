@@ -1,4 +1,7 @@
+from whatsappy.cache import SessionCache
 from whatsappy.client import Client
+from whatsappy.loop import Loop
+from whatsappy.manager import Manager
 from whatsappy.node import Node
 
 from whatsappy.exceptions import *
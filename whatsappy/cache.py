@@ -0,0 +1,108 @@
+from collections import OrderedDict
+from hashlib import sha1
+
+import os
+import json
+
+# Default number of sessions to keep
+CACHE_SIZE = 1024
+
+
+class SessionCache(object):
+    """
+    Least recently used cache of session keys, together with the state of the
+    RC4 engines after the initial bytes are dropped. Reconnecting with the same
+    secret and auth blob then skips key derivation, and the RC4 drop. Clients
+    fill the cache with the keys of the next auth blob when they log in.
+    Challenges are random, so their sessions are not worth caching.
+
+    Entries are keyed by a digest of the secret, so secrets are never stored.
+    The session keys are, however, so a cache file should be protected like
+    the secrets themselves.
+
+    If a 'path' is given, the cache is loaded from that file if it exists, and
+    written to it by save.
+    """
+
+    def __init__(self, size=CACHE_SIZE, path=None):
+        self.size = size
+        self.path = path
+
+        self.entries = OrderedDict()
+
+        # Statistics
+        self.hits = 0
+        self.misses = 0
+
+        if path is not None and os.path.exists(path):
+            self.load()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def key(self, kind, secret, salt):
+        """
+        Return the cache key for the keys of a session.
+
+        kind -- Name of the key derivation, e.g. the Encryption class.
+        secret -- Secret of the account.
+        salt -- Challenge or auth blob the keys are derived from.
+        """
+
+        return "%s:%s:%s" % (
+            kind, sha1(secret).hexdigest(), salt.encode("hex"))
+
+    def get(self, key):
+        """
+        Return the entry for a key, or None. Entries are tuples of the session
+        keys and the states of the incoming and outgoing RC4 engines.
+        """
+
+        entry = self.entries.pop(key, None)
+
+        if entry is not None:
+            self.entries[key] = entry
+            self.hits += 1
+        else:
+            self.misses += 1
+
+        return entry
+
+    def put(self, key, entry):
+        self.entries.pop(key, None)
+        self.entries[key] = entry
+
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def discard(self, key):
+        self.entries.pop(key, None)
+
+    def clear(self):
+        self.entries.clear()
+
+    def load(self):
+        with open(self.path, "rb") as fp:
+            entries = json.load(fp)
+
+        for key, (keys, rc4_in, rc4_out) in entries:
+            self.put(str(key), (
+                [value.decode("hex") for value in keys],
+                (tuple(rc4_in[0]), rc4_in[1], rc4_in[2]),
+                (tuple(rc4_out[0]), rc4_out[1], rc4_out[2])))
+
+    def save(self):
+        """
+        Write the cache to its file. The file is replaced atomically.
+        """
+
+        entries = [
+            (key, ([value.encode("hex") for value in keys], rc4_in, rc4_out))
+            for key, (keys, rc4_in, rc4_out) in self.entries.iteritems()]
+
+        temp = self.path + ".tmp"
+
+        with open(temp, "wb") as fp:
+            json.dump(entries, fp)
+
+        os.rename(temp, self.path)
@@ -1,3 +1,88 @@
+import collections
+
+
+class CallbackIndex(object):
+    """
+    Index of registered callbacks. Callbacks are indexed on the node name and
+    the values returned by their key method: the type attribute, the name of
+    the first child, and whether a participant is present. Matching a node
+    only looks up the buckets for the key patterns in use, instead of testing
+    every callback.
+
+    The key of a callback is computed when it is added.
+    """
+
+    def __init__(self):
+        self.buckets = collections.defaultdict(list)
+        self.patterns = collections.defaultdict(collections.Counter)
+        self.entries = {}
+        self.counter = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, callback):
+        return callback in self.entries
+
+    def add(self, callback):
+        key = (callback.name, ) + callback.key()
+        pattern = tuple(value is not None for value in key[1:])
+
+        self.counter += 1
+        entry = (self.counter, callback)
+
+        self.buckets[key].append(entry)
+        self.patterns[callback.name][pattern] += 1
+        self.entries[callback] = (key, pattern, entry)
+
+    def remove(self, callback):
+        if callback not in self.entries:
+            raise ValueError("Callback not registered: %r" % callback)
+
+        key, pattern, entry = self.entries.pop(callback)
+
+        self.buckets[key].remove(entry)
+        if not self.buckets[key]:
+            del self.buckets[key]
+
+        patterns = self.patterns[callback.name]
+        patterns[pattern] -= 1
+        if not patterns[pattern]:
+            del patterns[pattern]
+
+    def match(self, node):
+        """
+        Return the callbacks that may match the node, most recently added
+        first. Their test method should still be called.
+        """
+
+        patterns = self.patterns.get(node.name)
+
+        if not patterns:
+            return []
+
+        first = node.first_child()
+        values = (
+            node.get("type"),
+            first.name if first is not None else None,
+            bool(node.get("participant")))
+        entries = []
+
+        for pattern in patterns:
+            key = (node.name, ) + tuple(
+                value if indexed else None
+                for value, indexed in zip(values, pattern))
+
+            entries.extend(self.buckets.get(key, ()))
+
+        if len(patterns) > 1:
+            entries.sort(reverse=True)
+        else:
+            entries.reverse()
+
+        return [callback for _, callback in entries]
+
+
 class Callback(object):
     """
     General callback for received nodes.
@@ -27,6 +112,15 @@ class Callback(object):
         self.result = self.callback(node)
         self.called += 1
 
+    def key(self):
+        """
+        Return the values a node should have to pass the test, as a tuple of
+        the type attribute, the name of the first child and whether a
+        participant is present. None means any value.
+        """
+
+        return (None, None, None)
+
     def test(self, node):
         """
         Test whether a callback should be executed.
@@ -37,6 +131,69 @@ class Callback(object):
         return True
 
 
+class Request(object):
+    """
+    Pending request, resolved by the response with the same id. The result is
+    the response node, or the return value of 'parser' if given. If a
+    'callback' is given, it is called with the result.
+    """
+
+    __slots__ = ("id", "parser", "callback", "called", "result", "timer",
+                 "pending")
+
+    def __init__(self, id, parser=None, callback=None):
+        """
+        Construct a new request.
+
+        id -- Id of the request stanza.
+        parser -- Function to convert the response node into the result.
+        callback -- Function to call with the result.
+        """
+
+        self.id = id
+        self.parser = parser
+        self.callback = callback
+        self.called = 0
+        self.result = None
+
+        # Timeout timer, and the registry of pending requests
+        self.timer = None
+        self.pending = None
+
+    def __call__(self, node):
+        """
+        Resolve the request with the response node.
+        """
+
+        self.resolve(self.parser(node) if self.parser else node)
+
+    def resolve(self, result):
+        """
+        Resolve the request with a result, which may be an exception.
+        """
+
+        self.cancel()
+
+        self.result = result
+        self.called += 1
+
+        if self.callback:
+            self.callback(result)
+
+    def cancel(self):
+        """
+        Stop waiting for a response.
+        """
+
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+        if self.pending is not None:
+            self.pending.pop(self.id, None)
+            self.pending = None
+
+
 class LoginSuccessCallback(Callback):
     """
     Callback for succesful login.
@@ -118,7 +275,7 @@ class ChatStateCallback(Callback):
         self.paused = paused
 
     def test(self, node):
-        child_name = node.children[0].name
+        child_name = node.first_child().name
 
         if child_name == "paused":
             if not self.paused:
@@ -224,6 +381,11 @@ class MessageCallback(Callback):
         self.group = group
         self.offline = offline
 
+    def key(self):
+        if self.single == self.group:
+            return (None, None, None)
+        return (None, None, self.group)
+
     def test(self, node):
         # Include group messages or not
         if node.get("participant"):
@@ -247,6 +409,9 @@ class TextMessageCallback(MessageCallback):
 
     __slots__ = MessageCallback.__slots__
 
+    def key(self):
+        return ("text", ) + super(TextMessageCallback, self).key()[1:]
+
     def test(self, node):
         # Chat messages only
         if node.get("type") != "text":
@@ -275,6 +440,9 @@ class MediaMessageCallback(MessageCallback):
 
         self.types = types
 
+    def key(self):
+        return ("media", ) + super(MediaMessageCallback, self).key()[1:]
+
     def test(self, node):
         # Media messages only
         if node.get("type") != "media":
@@ -288,6 +456,67 @@ class MediaMessageCallback(MessageCallback):
         return super(MediaMessageCallback, self).test(node)
 
 
+class DeliveryCallback(Callback):
+    """
+    Callback that tracks the receipts of sent messages, e.g. of a broadcast.
+    The callback is called with the recipient and the receipt node, for the
+    first receipt of every message.
+    """
+
+    __slots__ = Callback.__slots__ + ("messages", "delivered", "read",
+                                      "complete")
+
+    def __init__(self, messages, callback=None):
+        """
+        Construct a new callback.
+
+        messages -- Dictionary of message ids to recipients.
+        callback -- Function to execute for every delivered message.
+        """
+
+        super(DeliveryCallback, self).__init__("receipt", callback)
+
+        self.messages = dict(messages)
+        self.delivered = set()
+        self.read = set()
+
+        # Function to call without arguments once all messages are delivered
+        self.complete = None
+
+    @property
+    def pending(self):
+        """
+        Recipients that did not receive their message yet.
+        """
+
+        return set(self.messages.itervalues()) - self.delivered
+
+    @property
+    def done(self):
+        return len(self.delivered) == len(self.messages)
+
+    def test(self, node):
+        return node.get("id") in self.messages
+
+    def __call__(self, node):
+        recipient = self.messages[node["id"]]
+
+        if node.get("type") == "read":
+            self.read.add(recipient)
+
+        if recipient in self.delivered:
+            return
+
+        self.delivered.add(recipient)
+        self.called += 1
+
+        if self.callback:
+            self.result = self.callback(recipient, node)
+
+        if self.complete and self.done:
+            self.complete()
+
+
 class SyncResultCallback(Callback):
     """
     Callback for contact sync result.
@@ -1,22 +1,39 @@
-from whatsappy.stream import Reader, Writer, MessageIncomplete, EndOfStream
+from whatsappy.stream import Reader, Writer, Template, MessageIncomplete, \
+    EndOfStream
 from whatsappy.encryption import Encryption, AuthBlobEncryption
-from whatsappy.callbacks import Callback, LoginSuccessCallback, \
-    LoginFailedCallback
+from whatsappy.scheduler import Scheduler, HIGH, priority, throttled
+from whatsappy.callbacks import CallbackIndex, Request, \
+    LoginSuccessCallback, LoginFailedCallback, DeliveryCallback
 from whatsappy.node import Node
-from whatsappy.exceptions import ConnectionError, StreamError, LoginError
+from whatsappy.loop import Loop
+from whatsappy.exceptions import ConnectionError, StreamError, LoginError, \
+    TimeoutError
 from whatsappy import utils
 
-from select import select
 from time import time
 
 import sys
+import errno
+import random
+import select
 import socket
 import logging
-import collections
 
 CHATSTATE_NS = "http://jabber.org/protocol/chatstates"
 CHATSTATES = ("active", "inactive", "composing", "paused", "gone")
 
+# Constant parts of stanzas, which are serialized once
+MESSAGE_EVENT = Template(
+    Node("x", xmlns="jabber:x:event", children=[Node("server")]))
+MESSAGE_REQUEST = Template(Node("request", xmlns="urn:xmpp:receipts"))
+
+CHATSTATE_NODES = dict(
+    (state, Template(Node(state, xmlns=CHATSTATE_NS)))
+    for state in CHATSTATES)
+PRESENCE_NODES = dict(
+    (state, Template(Node("presence", type=state)))
+    for state in ("active", "unavailable"))
+
 # Remote server settings
 HOST = "c.whatsapp.net"
 PORT = 443
@@ -30,6 +47,25 @@ PROTOCOL_USER_AGENT = "WhatsApp/2.12.89 S40Version/14.26 Device/Nokia302"
 TIMEOUT = 1
 ALIVE_INTERVAL = 20
 
+# Outbound frames are queued, and written at once when the queue holds at
+# least FLUSH_SIZE bytes, or when the oldest frame waited FLUSH_LATENCY seconds
+# while more frames are queued. Otherwise, the loop writes them when it waits
+# for the next event, so frames queued by one callback share one write.
+FLUSH_SIZE = 16384
+FLUSH_LATENCY = 0.05
+
+# Delay before the first reconnect attempt, which doubles for every failed
+# attempt up to RECONNECT_MAX_DELAY seconds. Delays are randomized by up to
+# half, so clients that lost the same server do not reconnect at once.
+RECONNECT_DELAY = 1.0
+RECONNECT_MAX_DELAY = 60.0
+
+# Number of contacts per sync request
+SYNC_CHUNK_SIZE = 1000
+
+# Result lists of a sync, of which the users are streamed while decoding
+SYNC_LISTS = ("in", "out", "invalid")
+
 # Logger instance
 logger = logging.getLogger(__name__)
 
@@ -38,7 +74,8 @@ class Client(object):
     SERVER = "s.whatsapp.net"
     GROUPHOST = "g.us"
 
-    def __init__(self, number, secret, nickname=None, auth_blob=None):
+    def __init__(self, number, secret, nickname=None, auth_blob=None,
+                 host=None, port=None):
 
         self.number = number
         self.secret = secret
@@ -46,46 +83,243 @@ class Client(object):
 
         self.auth_blob = auth_blob
 
+        # Remote server, e.g. a MockServer for testing
+        self.host = HOST if host is None else host
+        self.port = PORT if port is None else port
+
         self.auto_receipt = True
 
+        # Reconnect when the connection is lost after a login, instead of
+        # raising a ConnectionError. Requires a loop to schedule attempts.
+        self.auto_reconnect = False
+        self.reconnect_delay = RECONNECT_DELAY
+        self.reconnect_max_delay = RECONNECT_MAX_DELAY
+        self.reconnect_attempts = 0
+        self.reconnect_timer = None
+        self.reconnecting = False
+
         self.debug = False
         self.debug_out = sys.stdout.write
         self.socket = None
+        self.connecting = False
+
+        self.flush_size = FLUSH_SIZE
+        self.flush_latency = FLUSH_LATENCY
+        self.outbox = []
+        self.outbox_size = 0
+        self.outbox_time = None
+
+        # Number of bytes of the first queued frame already written, and the
+        # total number of bytes queued and written
+        self.outbox_offset = 0
+        self.bytes_queued = 0
+        self.bytes_written = 0
+
+        # Stanzas of queued frames, with the number of queued bytes up to the
+        # end of their frame, and stanzas to write after the next login when
+        # reconnecting
+        self.unsent = []
+        self.replay = []
 
         self.account_info = None
         self.counter = 0
 
+        # SessionCache for the keys of auth blob logins, e.g. shared by the
+        # clients of a process. Disabled by default.
+        self.session_cache = None
+
+        # Template of the notify node, which depends on the nickname
+        self.notify = None
+
+        self.loop = None
         self.last_ping = time()
+        self.keepalive_timer = None
+
+        # Pacing of outgoing stanzas. Set to None to send without pacing.
+        self.scheduler = Scheduler()
+        self.scheduler_timer = None
+
+        self.callbacks = CallbackIndex()
+        self.requests = {}
+        self.login_callbacks = ()
 
-        self.callbacks = collections.defaultdict(list)
+        # Requests of which the response is streamed, see Reader.read
+        self.streams = {}
 
-    def _connect(self):
-        logger.info("Connecting to %s:%d", HOST, PORT)
+    def _connect(self, block=True):
+        """
+        Connect the socket. If 'block' is False, the connection is completed
+        in the background, and queued frames are written once the socket is
+        writable.
+        """
+
+        logger.info("Connecting to %s:%d", self.host, self.port)
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 
+        if block:
+            try:
+                self.socket.connect((self.host, self.port))
+            except socket.error:
+                raise ConnectionError("Unable to connect to remote server")
+
+        # Reads and writes never block the loop
+        self.socket.setblocking(0)
+
+        if block:
+            return
+
         try:
-            self.socket.connect((HOST, PORT))
+            error = self.socket.connect_ex((self.host, self.port))
         except socket.error:
+            error = errno.EHOSTUNREACH
+
+        if error not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            self.socket.close()
+            self.socket = None
             raise ConnectionError("Unable to connect to remote server")
 
-    def _disconnect(self):
+        self.connecting = True
+
+    def _connected(self):
+        """
+        Return True if a connection started in the background is completed.
+        Raises a ConnectionError, or reconnects, if it failed.
+        """
+
+        _, writable, _ = select.select([], [self.socket], [], 0)
+
+        if not writable:
+            return False
+
+        if self.socket.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR):
+            self._disconnected()
+            return False
+
+        self.connecting = False
+
+        return True
+
+    def _disconnect(self, resume=False):
+        """
+        Close the connection. If 'resume' is True, queued stanzas are kept to
+        be sent after the next login, as well as the requests they belong to.
+        """
+
         if self.socket is not None:
             self.socket.close()
             self.socket = None
 
+        self.connecting = False
+
+        self.outbox = []
+        self.outbox_size = 0
+        self.outbox_offset = 0
+        self.bytes_queued = 0
+        self.bytes_written = 0
+        self.outbox_time = None
+
+        if self.keepalive_timer is not None:
+            self.keepalive_timer.cancel()
+            self.keepalive_timer = None
+
+        if self.scheduler_timer is not None:
+            self.scheduler_timer.cancel()
+            self.scheduler_timer = None
+
+        # Fail pending requests, except those of queued stanzas
+        requests, self.requests = self.requests, {}
+
+        if resume:
+            # Frames are encrypted for this session, so keep their stanzas
+            self.replay.extend(node for node, _ in self.unsent)
+            self.unsent = []
+
+            queued = list(self.replay)
+
+            if self.scheduler is not None:
+                queued.extend(self.scheduler)
+
+            for node in queued:
+                request = requests.pop(node.get("id"), None)
+
+                if request is not None:
+                    request.pending = self.requests
+                    self.requests[request.id] = request
+        else:
+            if self.reconnect_timer is not None:
+                self.reconnect_timer.cancel()
+                self.reconnect_timer = None
+
+            if self.scheduler is not None:
+                self.scheduler.clear()
+
+            self.unsent = []
+            self.replay = []
+            self.reconnecting = False
+            self.reconnect_attempts = 0
+            self.counter = 0
+
+        for request in requests.itervalues():
+            request.resolve(ConnectionError("Disconnected"))
+
         self.account_info = None
-        self.counter = 0
 
     def _disconnected(self):
-        self._disconnect()
-        raise ConnectionError("Socket closed by remote party")
+        """
+        Handle a connection closed by the remote party. A client that was
+        logged in reconnects if 'auto_reconnect' is set, otherwise a
+        ConnectionError is raised.
+        """
+
+        resume = self.auto_reconnect and self.loop is not None and (
+            self.account_info is not None or self.reconnecting)
+        connecting = self.connecting
+
+        self._disconnect(resume)
+
+        if not resume:
+            if connecting:
+                raise ConnectionError("Unable to connect to remote server")
+            raise ConnectionError("Socket closed by remote party")
+
+        logger.info("Connection lost, reconnecting")
+        self.reconnecting = True
+        self._reconnect_later()
+
+    def _reconnect_later(self):
+        delay = min(
+            self.reconnect_max_delay,
+            self.reconnect_delay * 2 ** self.reconnect_attempts)
+        delay = random.uniform(delay / 2, delay)
+
+        self.reconnect_attempts += 1
+        self.reconnect_timer = self.loop.call_later(delay, self._reconnect)
+
+    def _reconnect(self):
+        self.reconnect_timer = None
+
+        if self.loop is None:
+            return
+
+        logger.debug("Reconnect attempt %d", self.reconnect_attempts)
+
+        try:
+            self.connect(block=False)
+        except ConnectionError as e:
+            logger.debug("Reconnect failed: %s", e)
+
+            self._disconnect(True)
+            self._reconnect_later()
 
     def _write(self, buf, encrypt=None):
+        node = None
+
         if isinstance(buf, Node):
             if self.debug:
                 self.debug_out(utils.dump_xml(buf, prefix="xml >>  ") + "\n")
 
-            buf, plain = self.writer.node(buf, encrypt)
+            node = buf
+            buf, plain = self.writer.node(buf, encrypt, copy_plain=self.debug)
         else:
             plain = buf
 
@@ -95,40 +329,106 @@ class Client(object):
         if self.debug:
             self.debug_out(utils.dump_bytes(buf, prefix="    >>  ") + "\n")
 
-        try:
-            self.socket.sendall(buf)
-        except socket.error:
-            self._disconnected()
+        # Queue the frame. Frames are already encrypted, so they should be
+        # written in the order they are queued.
+        if not self.outbox:
+            self.outbox_time = time()
 
-    def _read(self, limit=4096):
-        # See if there's data available to read.
-        try:
-            r, w, x, = select([self.socket], [], [], TIMEOUT)
-        except (TypeError, socket.error):
-            self._disconnected()
+        self.outbox.append(buf)
+        self.outbox_size += len(buf)
+        self.bytes_queued += len(buf)
 
-        if self.socket in r:
-            # Receive any available data, update Reader's buffer
-            try:
-                buf = self.socket.recv(limit)
-            except socket.error:
-                buf = None
+        # Keep the stanza until its frame is written, to replay it after a
+        # reconnect
+        if node is not None and self.auto_reconnect and \
+                self.account_info is not None:
+            self.unsent.append((node, self.bytes_queued))
 
-            # Check for end of stream
-            if not buf:
-                self._disconnected()
+        # The latency is checked here only, without a timer. A lone frame is
+        # written by the next iteration of the loop instead.
+        if self.outbox_size >= self.flush_size or \
+                (time() - self.outbox_time) >= self.flush_latency:
+            self.flush()
 
-            if self.debug:
-                self.debug_out(utils.dump_bytes(buf, prefix="    <<  ") + "\n")
+    def _send(self, node):
+        """
+        Send a stanza via the scheduler. Stanzas are queued until the client
+        is logged in, and then written as the rate allows. Responses, such as
+        receipts, are written immediately, or after the login if the client is
+        reconnecting.
+        """
+
+        if self.scheduler is not None and priority(node) != HIGH:
+            self.scheduler.push(node, priority(node))
+
+            if self.scheduler_timer is None:
+                self._schedule()
+        elif self.reconnecting:
+            self.replay.append(node)
+        else:
+            self._write(node)
+
+    def _schedule(self):
+        """
+        Write queued stanzas, and wait for more tokens if stanzas remain.
+        Stanzas are encrypted when they are written, so the frames are in the
+        order of their sequence numbers.
+        """
+
+        self.scheduler_timer = None
+
+        # Writing may lose the connection, which stops the loop
+        while self.account_info is not None:
+            node = self.scheduler.pop()
+
+            if node is None:
+                break
+            self._write(node)
+
+        if self.account_info is None:
+            return
+
+        delay = self.scheduler.delay()
+
+        if delay is not None and self.loop is not None:
+            self.scheduler_timer = self.loop.call_later(delay, self._schedule)
 
-            self.reader.data(buf)
+    def _recv(self, limit=4096):
+        # Receive any available data, update Reader's buffer
+        try:
+            buf = self.socket.recv(limit)
+        except socket.error as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            buf = None
+        except AttributeError:
+            buf = None
+
+        # Check for end of stream
+        if not buf:
+            return self._disconnected()
+
+        if self.debug:
+            self.debug_out(utils.dump_bytes(buf, prefix="    <<  ") + "\n")
+
+        self.reader.data(buf)
 
+    def _nodes(self):
         # Process received nodes
         nodes = []
 
         while True:
             try:
-                node, plain = self.reader.read()
+                stream = None
+
+                if self.streams:
+                    header = self.reader.peek()
+
+                    if header.name == "iq":
+                        stream = self.streams.get(header.get("id"))
+
+                node, plain = self.reader.read(
+                    copy_plain=self.debug, stream=stream)
 
                 if self.debug:
                     self.debug_out(
@@ -149,27 +449,34 @@ class Client(object):
         return nodes
 
     def _challenge(self, node):
+        # Challenges are random, so their sessions are not cached
         encryption = Encryption(self.secret, node.data)
         logger.debug(
             "Session Keys: %s", [key.encode("hex") for key in encryption.keys])
 
-        self.writer.encrypt = encryption.encrypt
+        self.writer.encrypt = encryption.encrypt_into
         self.reader.decrypt = encryption.decrypt
 
         data = "%s%s%s" % (self.number, node.data, utils.timestamp())
         response = Node("response", data=encryption.encrypt(data, False))
 
         self._write(response, encrypt=False)
-        self._incoming()
 
     def _iq(self, node):
+        # Resolve pending request
+        request = self.requests.get(node.get("id"))
+
+        if request is not None:
+            request(node)
+
         # Node without children could be a ping reply
-        if len(node.children) == 0:
+        iq = node.first_child()
+
+        if iq is None:
             return
 
-        iq = node.children[0]
         if node["type"] == "get" and iq.name == "ping":
-            self._write(
+            self._send(
                 Node("iq", to=self.SERVER, id=node["id"], type="result"))
         elif node["type"] == "result":
             pass
@@ -182,12 +489,12 @@ class Client(object):
         for category in categories:
             nodes.append(Node("clean", type=category))
 
-        self._write(Node(
+        self._send(Node(
             "iq", id=self._msgid("cleardirty"), type="set", to=self.SERVER,
             xmlns="urn:xmpp:whatsapp:dirty", children=nodes))
 
     def _ib(self, node):
-        for child in node.children:
+        for child in node.iter_children():
             if child.name == "dirty":
                 self._clear_dirty(child["type"])
             elif child.name == "offline":
@@ -206,12 +513,16 @@ class Client(object):
         if node.has_attribute("participant"):
             out["participant"] = node["participant"]
 
-        self._write(out)
-
-    def _incoming(self):
-        nodes = self._read()
+        self._send(out)
 
+    def _handle(self, nodes):
         for node in nodes:
+            if self.scheduler is not None:
+                if throttled(node):
+                    self.scheduler.backoff()
+                if node.name in ("receipt", "ack", "iq"):
+                    self.scheduler.acknowledged(node.get("id"))
+
             if node.name == "challenge":
                 self._challenge(node)
             elif node.name == "message":
@@ -226,21 +537,41 @@ class Client(object):
             elif node.name in ("start", "stream:features"):
                 pass
             elif node.name == "stream:error":
-                raise StreamError(node.children[0].name)
+                raise StreamError(node.first_child().name)
 
             # Handle callbacks
-            if node.name in self.callbacks:
-                for callback in self.callbacks[node.name]:
-                    if callback.test(node):
-                        callback(node)
+            for callback in self.callbacks.match(node):
+                if callback.test(node):
+                    callback(node)
 
     def _msgid(self, prefix):
         """
         Generate a unique message ID.
         """
 
+        self.counter += 1
         return "%s-%s-%d" % (prefix, utils.timestamp(), self.counter)
 
+    def _request(self, node, parser=None, callback=None, timeout=None):
+        """
+        Write a request node, and register a Request that is resolved by the
+        response with the same id. If 'timeout' is given, the request resolves
+        with a TimeoutError when no response is received in time.
+        """
+
+        request = Request(node["id"], parser, callback)
+        request.pending = self.requests
+
+        if timeout is not None and self.loop is not None:
+            request.timer = self.loop.call_later(
+                timeout, request.resolve,
+                TimeoutError("No response within %s seconds" % timeout))
+
+        self.requests[request.id] = request
+        self._send(node)
+
+        return request
+
     def _jid(self, number):
         """
         Return Jabber ID for given number.
@@ -259,75 +590,236 @@ class Client(object):
         msgid = self._msgid("message")
         to = self._jid(to)
 
-        x = Node("x", xmlns="jabber:x:event", children=Node("server"))
-        notify = Node("notify", xmlns="urn:xmpp:whatsapp", name=self.nickname)
-        request = Node("request", xmlns="urn:xmpp:receipts")
+        if self.notify is None or self.notify["name"] != self.nickname:
+            self.notify = Template(Node(
+                "notify", xmlns="urn:xmpp:whatsapp", name=self.nickname))
 
         message = Node(
             "message", to=to, type="text", id=msgid, t=utils.timestamp(),
-            children=[x, notify, request, node])
+            children=[MESSAGE_EVENT, self.notify, MESSAGE_REQUEST, node])
 
         return msgid, message
 
     def _receipt(self, node):
-        self._write(Node(
+        self._send(Node(
             "receipt", type="read", to=node["from"], id=node["id"],
             t=utils.timestamp()))
 
     def register_callback(self, *callbacks):
         for callback in callbacks:
-            self.callbacks[callback.name].insert(0, callback)
+            self.callbacks.add(callback)
 
     def unregister_callback(self, *callbacks):
         for callback in callbacks:
-            self.callbacks[callback.name].remove(callback)
+            self.callbacks.remove(callback)
 
-    def register_callback_and_wait(self, *callbacks):
+    def register_callback_and_wait(self, *callbacks, **kwargs):
         self.register_callback(*callbacks)
-        self.wait_for_callback(*callbacks)
+        return self.wait_for_callback(*callbacks, **kwargs)
 
-    def wait_for_callback(self, *callbacks):
-        called = None
+    def _run_until(self, condition, timeout=None):
+        """
+        Run the loop of this client until 'condition' returns True. Raises a
+        TimeoutError if it does not within 'timeout' seconds.
+        """
 
-        # Wait for one of the callbacks to happen
-        while not called:
-            for callback in callbacks:
-                if callback.called:
-                    called = callback
-                    break
-            else:
-                self._incoming()
+        deadline = None if timeout is None else time() + timeout
+        remaining = None
+
+        if self.loop is None:
+            raise ConnectionError("Client is not connected")
+
+        while not condition():
+            if deadline is not None:
+                remaining = deadline - time()
+
+                if remaining <= 0:
+                    raise TimeoutError(
+                        "No response within %s seconds" % timeout)
+
+            self.loop.run_once(remaining)
+
+    def wait_for_callback(self, *callbacks, **kwargs):
+        """
+        Run the loop of this client until one of the callbacks is called, and
+        return its result. If 'timeout' is given, TimeoutError is raised when
+        none of the callbacks is called in time.
+        """
+
+        def called():
+            return any(callback.called for callback in callbacks)
 
-        # Unregister all callbacks
-        self.unregister_callback(*callbacks)
+        # Wait for one of the callbacks to happen
+        try:
+            self._run_until(called, kwargs.get("timeout"))
+        finally:
+            self.unregister_callback(*callbacks)
 
         # Process result
-        if isinstance(called.result, Exception):
-            raise called.result
+        for callback in callbacks:
+            if callback.called:
+                break
+
+        if isinstance(callback.result, Exception):
+            raise callback.result
+
+        return callback.result
 
-        return called.result
+    def wait_for_request(self, request, timeout=None):
+        """
+        Run the loop of this client until the request is resolved, and return
+        its result.
+        """
+
+        try:
+            self._run_until(lambda: request.called, timeout)
+        except TimeoutError:
+            request.cancel()
+            raise
+
+        if isinstance(request.result, Exception):
+            raise request.result
+
+        return request.result
 
     def service_loop(self):
-        # Handle incoming data
-        self._incoming()
+        """
+        Handle incoming data, outgoing data and timers, such as pings. Waits
+        at most TIMEOUT seconds for an event.
+        """
+
+        self.loop.run_once(TIMEOUT)
+
+    def fileno(self):
+        """
+        Return the file descriptor of the socket, so a client can be passed to
+        select() directly.
+        """
+
+        return self.socket.fileno()
+
+    def receive(self, limit=4096):
+        """
+        Receive data from the socket, and handle all complete nodes. This is
+        the non-blocking counterpart of service_loop, for use with an event
+        loop that calls it when the socket is readable.
+        """
+
+        self._recv(limit)
+
+        # Nothing to handle if the client is reconnecting
+        if self.socket is not None:
+            self._handle(self._nodes())
+
+    def keepalive(self):
+        """
+        Send a ping if the last one was sent ALIVE_INTERVAL seconds ago, and
+        schedule the next check on the loop of this client.
+        """
+
+        if self.socket is None:
+            return
 
-        # Send a ping once in a while if keep alive and still connected
-        if (time() - self.last_ping) > ALIVE_INTERVAL:
+        if (time() - self.last_ping) >= ALIVE_INTERVAL:
             self.presence("active")
             self.last_ping = time()
 
+        if self.keepalive_timer is not None:
+            self.keepalive_timer.cancel()
+
+        if self.loop is not None:
+            self.keepalive_timer = self.loop.call_later(
+                ALIVE_INTERVAL - (time() - self.last_ping), self.keepalive)
+
+    def flush(self):
+        """
+        Write as many queued frames to the socket as it accepts, using one
+        call. The socket does not block, so frames that are not written stay
+        queued, and the loop calls flush again once the socket is writable.
+        """
+
+        if not self.outbox:
+            return
+
+        # Keep the frames until a background connection is completed
+        if self.connecting and not self._connected():
+            return
+
+        # Join the frames, including what is left of a partly written one
+        if len(self.outbox) > 1:
+            if self.outbox_offset:
+                self.outbox[0] = self.outbox[0][self.outbox_offset:]
+                self.outbox_offset = 0
+
+            self.outbox = [bytearray().join(self.outbox)]
+
+        buf = self.outbox[0]
+
+        try:
+            written = self.socket.send(memoryview(buf)[self.outbox_offset:])
+        except socket.error as e:
+            if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return self._disconnected()
+            written = 0
+
+        self.outbox_offset += written
+        self.outbox_size -= written
+        self.bytes_written += written
+
+        if self.outbox_offset == len(buf):
+            self.outbox = []
+            self.outbox_offset = 0
+            self.outbox_time = None
+
+        # Forget the stanzas of frames that are written completely
+        count = 0
+
+        for _, end in self.unsent:
+            if end > self.bytes_written:
+                break
+            count += 1
+
+        if count:
+            del self.unsent[:count]
+
     def disconnect(self):
+        # Write the queued frames, unless the socket stays busy
+        while self.socket is not None and self.outbox:
+            _, writable, _ = select.select([], [self.socket], [], TIMEOUT)
+
+            if not writable:
+                break
+            self.flush()
+
         self._disconnect()
         logger.debug("Disconnected by user")
 
-    def connect(self):
+    def connect(self, block=True):
+        """
+        Connect and login. If 'block' is False, this method does not wait for
+        the connection or the login. The login is sent once the connection is
+        completed, and the response is handled by subsequent calls to flush
+        and receive, e.g. from an event loop. Connection and login errors are
+        then raised from there. Otherwise, the client runs on a loop of its
+        own.
+        """
+
+        if block and self.loop is None:
+            Loop().add(self)
+
+        # Callbacks of an interrupted login
+        self.unregister_callback(*[
+            callback for callback in self.login_callbacks
+            if callback in self.callbacks])
+        self.login_callbacks = ()
+
         self.reader = Reader()
         self.writer = Writer()
 
-        self._connect()
+        self._connect(block)
 
         buf = self.writer.start_stream(self.SERVER, "%s-%s-%d" % (
-            PROTOCOL_DEVICE, PROTOCOL_VERSION, PORT))
+            PROTOCOL_DEVICE, PROTOCOL_VERSION, self.port))
         self._write(buf)
 
         # Send features node
@@ -340,9 +832,11 @@ class Client(object):
 
         # Send auth node
         auth = Node("auth", mechanism="WAUTH-2", user=self.number)
+        encryption = None
 
         if self.auth_blob:
-            encryption = AuthBlobEncryption(self.secret, self.auth_blob)
+            encryption = AuthBlobEncryption(
+                self.secret, self.auth_blob, self.session_cache)
             logger.debug(
                 "Session Keys (re-using auth challenge): %s",
                 [key.encode("hex") for key in encryption.keys])
@@ -357,6 +851,26 @@ class Client(object):
         self._write(auth)
 
         def on_success(node):
+            self.login_callbacks = ()
+
+            if not block:
+                self.unregister_callback(success, failure)
+
+            # Without a challenge, the session continues with the keys of the
+            # auth blob
+            if self.writer.encrypt is None and encryption is not None:
+                self.writer.encrypt = encryption.encrypt_into
+
+            # Derive the keys of the next login now, so a reconnect does not
+            # have to. The keys of the previous blob are of no use anymore.
+            if self.session_cache is not None and node.data:
+                if self.auth_blob:
+                    self.session_cache.discard(self.session_cache.key(
+                        AuthBlobEncryption.__name__, self.secret,
+                        self.auth_blob))
+
+                AuthBlobEncryption(self.secret, node.data, self.session_cache)
+
             self.auth_blob = node.data
             self.account_info = node.attributes
 
@@ -364,18 +878,54 @@ class Client(object):
                 self._disconnect()
                 raise LoginError("Account marked as expired.")
 
-            self._write(Node("presence", name=self.nickname))
+            self.reconnecting = False
+            self.reconnect_attempts = 0
+
+            self._send(Node("presence", name=self.nickname))
+            self.keepalive()
+
+            # Replay stanzas that were not sent before a reconnect
+            replay, self.replay = self.replay, []
+
+            for queued in replay:
+                self._write(queued)
+
+            # Send stanzas queued before the login
+            if self.scheduler is not None:
+                self._schedule()
 
         def on_failure(node):
+            self.login_callbacks = ()
+
+            if not block:
+                self.unregister_callback(success, failure)
+
             self._disconnect()
             raise LoginError("Incorrect number and/or secret.")
 
+        success = LoginSuccessCallback(on_success)
+        failure = LoginFailedCallback(on_failure)
+        self.login_callbacks = (success, failure)
+
         # Wait for either success, or failure
-        self.register_callback_and_wait(
-            LoginSuccessCallback(on_success),
-            LoginFailedCallback(on_failure))
+        if block:
+            try:
+                self.register_callback_and_wait(success, failure)
+            finally:
+                self.login_callbacks = ()
+        else:
+            self.register_callback(success, failure)
+
+    def last_seen(self, number, callback=None, timeout=None):
+        """
+        Request the number of seconds since a contact was last seen.
+
+        If a callback is given, the Request is returned immediately, and the
+        callback is called with the result, or with an exception. This way,
+        many requests can be pipelined. Otherwise, this method blocks until
+        the result is received.
+        """
 
-    def last_seen(self, number):
         msgid = self._msgid("lastseen")
 
         iq = Node("iq", type="get", id=msgid)
@@ -383,22 +933,22 @@ class Client(object):
         iq["to"] = number + "@" + self.SERVER
         iq.add(Node("query", xmlns="jabber:iq:last"))
 
-        self._write(iq)
-
         def on_iq(node):
-            if node["id"] != msgid:
-                return
             if node["type"] == "error":
                 return StreamError(node.child("error").children[0].name)
             return int(node.child("query")["seconds"])
 
-        callback = Callback("iq", on_iq)
-        self.register_callback_and_wait(callback)
+        request = self._request(iq, on_iq, callback, timeout)
 
-    def send_sync(self, numbers, mode="full", context="registration", index=0,
-                  last=True):
+        if callback is not None:
+            return request
+        return self.wait_for_request(request)
+
+    def _sync(self, numbers, mode, context, index, last, sid):
         msgid = self._msgid("sync")
-        sid = (int(time()) + 11644477200) * 10000000
+
+        if sid is None:
+            sid = (int(time()) + 11644477200) * 10000000
 
         sync = Node(
             "sync", mode=mode, context=context, sid=str(sid), index=str(index),
@@ -414,35 +964,156 @@ class Client(object):
                 number = "+" + number
             sync.add(Node("user", data=number))
 
-        self._write(node)
+        return node
+
+    def send_sync(self, numbers, mode="full", context="registration", index=0,
+                  last=True, sid=None):
+        """
+        Send one sync request. Requests that are part of the same sync should
+        share the same 'sid', and are numbered by 'index'.
+        """
+
+        self._send(self._sync(numbers, mode, context, index, last, sid))
+
+    def sync_contacts(self, numbers, chunk_size=SYNC_CHUNK_SIZE, mode="full",
+                      context="registration", callback=None, timeout=None):
+        """
+        Sync a list of contacts. The numbers are normalized and deduplicated,
+        and split into chunks of 'chunk_size' numbers. The chunks are sent at
+        once, as one sync, and their results are merged as they arrive.
+
+        The result is a dictionary of the result lists, such as 'in' and
+        'out', to lists of user nodes. The users are merged while the results
+        are decoded, so a result is never built as a whole.
+
+        If a callback is given, the Request is returned immediately, and the
+        callback is called with the result, or with an exception. Otherwise,
+        this method blocks until all results are received.
+        """
+
+        if chunk_size < 1:
+            raise ValueError("Chunk size should be at least one")
+
+        numbers = utils.normalize_numbers(numbers)
+        chunks = [
+            numbers[i:i + chunk_size]
+            for i in xrange(0, len(numbers), chunk_size)] or [[]]
+
+        sid = (int(time()) + 11644477200) * 10000000
+        result = Request(str(sid), callback=callback)
+        merged = {}
+        requests = []
+
+        def on_iq(node):
+            if node["type"] == "error":
+                return StreamError(node.child("error").children[0].name)
+            if not node.has_child("sync"):
+                return StreamError("Unexpected sync result")
+            return node.child("sync")
+
+        def on_user(parent, user):
+            if not result.called:
+                merged.setdefault(parent.name, []).append(user)
+
+        def on_chunk(sync):
+            if result.called:
+                return
+
+            # Any failure, such as a timeout, fails the whole sync
+            if isinstance(sync, Exception):
+                return resolve(sync)
+
+            # Users of other lists than SYNC_LISTS are not streamed
+            for child in sync.children:
+                merged.setdefault(child.name, []).extend(child.children)
+
+            if all(request.called for request in requests):
+                resolve(merged)
+
+        def resolve(value):
+            for request in requests:
+                request.cancel()
+                self.streams.pop(request.id, None)
+
+            result.resolve(value)
+
+        for index, chunk in enumerate(chunks):
+            node = self._sync(
+                chunk, mode, context, index, index == len(chunks) - 1, sid)
+            request = self._request(node, on_iq, on_chunk, timeout)
+
+            self.streams[request.id] = (SYNC_LISTS, on_user)
+            requests.append(request)
+
+        if callback is not None:
+            return result
+        return self.wait_for_request(result)
+
+    def send_server_properties(self, callback=None, timeout=None):
+        """
+        Request the server properties. If a callback is given, it is called
+        with the response node. Returns the Request.
+        """
 
-    def send_server_properties(self):
         msgid = self._msgid("getproperties")
         node = Node("iq", id=msgid, type="get", xmlns="w", to=self.SERVER)
         node.add(Node("props"))
 
-        self._write(node)
+        return self._request(node, callback=callback, timeout=timeout)
 
     def message(self, number, text):
         msgid, message = self._message(number, Node("body", data=text))
-        self._write(message)
+        self._send(message)
         return msgid
 
+    def broadcast(self, numbers, text, callback=None):
+        """
+        Send the same text to many recipients. The body is serialized once,
+        and the messages are written in batches.
+
+        Returns a dictionary of recipients to message ids, and a registered
+        DeliveryCallback that tracks the receipts. The callback is called with
+        the recipient and the receipt node for every delivered message, and
+        is unregistered once all messages are delivered.
+        """
+
+        body = Template(Node("body", data=text))
+        msgids = {}
+
+        for number in numbers:
+            if number not in msgids:
+                msgid, message = self._message(number, body)
+                msgids[number] = msgid
+
+                self._send(message)
+
+        tracker = DeliveryCallback(
+            dict((msgid, number) for number, msgid in msgids.iteritems()),
+            callback)
+        tracker.complete = lambda: self.unregister_callback(tracker)
+
+        if msgids:
+            self.register_callback(tracker)
+
+        if self.socket is not None:
+            self.flush()
+
+        return msgids, tracker
+
     def group_message(self, group, text):
         msgid, message = self._message(group, Node("body", data=text), True)
-        self._write(message)
+        self._send(message)
         return msgid
 
     def presence(self, state):
-        self._write(Node("presence", type=state))
+        self._send(PRESENCE_NODES.get(state) or Node("presence", type=state))
 
     def chatstate(self, number, state):
         if state not in CHATSTATES:
             raise ValueError("Invalid chatstate: %r" % state)
 
-        node = Node(state, xmlns=CHATSTATE_NS)
-        msgid, message = self._message(number, node)
-        self._write(message)
+        msgid, message = self._message(number, CHATSTATE_NODES[state])
+        self._send(message)
         return msgid
 
     def image(self, number, url, basename, size, thumbnail=None):
@@ -460,7 +1131,7 @@ class Client(object):
         media = Node("media", xmlns="urn:xmpp:whatsapp:mms", type="image",
                      url=url, file=basename, size=str(size), data=thumbnail)
         msgid, message = self._message(number, media)
-        self._write(message)
+        self._send(message)
         return msgid
 
     def audio(self, number, url, basename, size, attributes):
@@ -476,7 +1147,7 @@ class Client(object):
                      url=url, file=basename, size=str(size), **attributes)
         msgid, message = self._message(number, media)
 
-        self._write(message)
+        self._send(message)
         return msgid
 
     def location(self, number, latitude, longitude):
@@ -489,7 +1160,7 @@ class Client(object):
             latitude=latitude, longitude=longitude)
         msgid, message = self._message(number, media)
 
-        self._write(message)
+        self._send(message)
         return msgid
 
     def vcard(self, number, name, data):
@@ -505,5 +1176,5 @@ class Client(object):
 
         msgid, message = self._message(number, media)
 
-        self._write(message)
+        self._send(message)
         return msgid
@@ -1,11 +1,15 @@
 from whatsappy.rc4 import RC4Engine
 from whatsappy.exceptions import EncryptionError
+from whatsappy import kdf
 
-from pbkdf2 import PBKDF2
 from hashlib import md5, sha1
 
 import hmac
 import struct
+import operator
+
+# Constant time comparison, if available (Python 2.7.7 and later)
+compare_digest = getattr(hmac, "compare_digest", operator.eq)
 
 class Encryption(object):
     """
@@ -16,6 +20,11 @@ class Encryption(object):
 
     Encryption and decryption is both done using a RC4 engine. After
     initializing the RC4 engines, the first 768 bytes are dropped.
+
+    If a SessionCache is given, the keys and the RC4 states after the drop
+    are taken from it, or added to it after they are computed.
+
+    The HMAC objects are keyed once, and copied for every frame.
     """
 
     KEY_ITERATIONS = 2
@@ -23,7 +32,7 @@ class Encryption(object):
 
     RC4_DROP = 768
 
-    def __init__(self, secret, challenge):
+    def __init__(self, secret, challenge, cache=None):
         self.secret = secret
         self.challenge = challenge
 
@@ -31,15 +40,37 @@ class Encryption(object):
         self.write_sequence = 0
         self.read_sequence = 0
 
-        # Compute keys
-        self.compute()
+        key = entry = None
+
+        if cache is not None:
+            key = cache.key(type(self).__name__, secret, challenge)
+            entry = cache.get(key)
+
+        if entry is not None:
+            keys, rc4_in, rc4_out = entry
+
+            self.keys = list(keys)
+            self.rc4_in = RC4Engine.from_state(rc4_in)
+            self.rc4_out = RC4Engine.from_state(rc4_out)
+        else:
+            # Compute keys
+            self.compute()
 
-        # Construct RC4 engines, from which the first 768 bytes are dropped.
-        self.rc4_in = RC4Engine(self.keys[2])
-        self.rc4_in.process_bytes("\0" * self.RC4_DROP)
+            # Construct RC4 engines, from which the first 768 bytes are
+            # dropped.
+            self.rc4_in = RC4Engine(self.keys[2])
+            self.rc4_in.skip(self.RC4_DROP)
 
-        self.rc4_out = RC4Engine(self.keys[0])
-        self.rc4_out.process_bytes("\0" * self.RC4_DROP)
+            self.rc4_out = RC4Engine(self.keys[0])
+            self.rc4_out.skip(self.RC4_DROP)
+
+            if cache is not None:
+                cache.put(key, (
+                    list(self.keys), self.rc4_in.state(),
+                    self.rc4_out.state()))
+
+        self.mac_out = hmac.new(self.keys[1], digestmod=sha1)
+        self.mac_in = hmac.new(self.keys[3], digestmod=sha1)
 
     def compute(self):
         """
@@ -51,10 +82,9 @@ class Encryption(object):
         """
 
         # Generate keys
-        for i in xrange(4):
-            key = PBKDF2(self.secret, self.challenge + chr(i + 1),
-                iterations=self.KEY_ITERATIONS).read(self.KEY_LENGTH)
-            self.keys.append(key)
+        self.keys = kdf.derive_keys(
+            self.secret, [self.challenge + chr(i + 1) for i in xrange(4)],
+            self.KEY_ITERATIONS, self.KEY_LENGTH)
 
     def encrypt(self, data, append_mac=True):
         """
@@ -67,38 +97,65 @@ class Encryption(object):
 
         # Encrypt message and calculate MAC
         encrypted = self.rc4_out.process_bytes(data)
-        mac = hmac.new(self.keys[1], encrypted + sequence,
-            digestmod=sha1).digest()
+
+        mac = self.mac_out.copy()
+        mac.update(encrypted)
+        mac.update(sequence)
+        mac = mac.digest()
 
         return encrypted + mac[:4] if append_mac else mac[:4] + encrypted
 
+    def encrypt_into(self, buf, start, end):
+        """
+        Encrypt the bytes buf[start:end] of a bytearray in place, and write the
+        MAC to the four bytes following it.
+        """
+
+        sequence = struct.pack(">I", self.write_sequence)
+        self.write_sequence += 1
+
+        # Encrypt message and calculate MAC
+        self.rc4_out.process_into(buf, start, end)
+
+        mac = self.mac_out.copy()
+        mac.update(memoryview(buf)[start:end])
+        mac.update(sequence)
+
+        buf[end:end + 4] = mac.digest()[:4]
+
     def decrypt(self, data):
         """
-        Decrypt a given string of bytes. Raises an EncryptionError if the MAC
-        fails.
+        Decrypt a given string of bytes, or a memoryview. Raises an
+        EncryptionError if the MAC fails.
         """
 
         sequence = struct.pack(">I", self.read_sequence)
         self.read_sequence += 1
 
-        # Calculate MAC
-        mac = hmac.new(self.keys[3], data[:-4] + sequence,
-            digestmod=sha1).digest()
+        # Calculate MAC, without copying the data
+        data = memoryview(data)
+        payload = data[:-4]
+        received = data[-4:].tobytes()
+
+        mac = self.mac_in.copy()
+        mac.update(payload)
+        mac.update(sequence)
+        mac = mac.digest()
 
         # Compare received MAC to calculated MAC
-        if mac[:4] != data[-4:]:
+        if not compare_digest(mac[:4], received):
             raise EncryptionError("MAC mismatch: expected %s, found %s" %
-                (mac[:4].encode("hex"), data[-4:].encode("hex")))
+                (mac[:4].encode("hex"), received.encode("hex")))
 
-        return self.rc4_in.process_bytes(data[:-4])
+        return self.rc4_in.process_bytes(payload)
 
 class AuthBlobEncryption(Encryption):
 
     KEY_ITERATIONS = 16
 
     def compute(self):
-        data = PBKDF2(self.secret, self.challenge,
-            iterations=self.KEY_ITERATIONS).read(self.KEY_LENGTH)
+        data = kdf.pbkdf2(
+            self.secret, self.challenge, self.KEY_ITERATIONS, self.KEY_LENGTH)
 
         for i in xrange(4):
             self.keys.append(data[i])
\ No newline at end of file
@@ -31,4 +31,11 @@ class LoginError(Error):
     """
     Error class for login related errors.
     """
+    pass
+
+
+class TimeoutError(Error):
+    """
+    Occurs when a response is not received in time.
+    """
     pass
\ No newline at end of file
@@ -0,0 +1,42 @@
+"""
+Key derivation backends. PBKDF2-HMAC-SHA1 is computed with hashlib if it is
+available (Python 2.7.8 and later), which is implemented in C. Otherwise, the
+pure-Python pbkdf2 package is used.
+"""
+
+try:
+    from hashlib import pbkdf2_hmac
+except ImportError:
+    pbkdf2_hmac = None
+
+try:
+    from pbkdf2 import PBKDF2
+except ImportError:
+    PBKDF2 = None
+
+
+def pbkdf2_hashlib(secret, salt, iterations, length):
+    return pbkdf2_hmac("sha1", secret, salt, iterations, length)
+
+
+def pbkdf2_package(secret, salt, iterations, length):
+    return PBKDF2(secret, salt, iterations=iterations).read(length)
+
+
+# Preferred backend
+if pbkdf2_hmac is not None:
+    pbkdf2 = pbkdf2_hashlib
+elif PBKDF2 is not None:
+    pbkdf2 = pbkdf2_package
+else:
+    raise ImportError(
+        "PBKDF2 requires Python 2.7.8 or later, or the pbkdf2 package")
+
+
+def derive_keys(secret, salts, iterations, length):
+    """
+    Derive one key per salt. Each key has its own salt, so the derivations
+    cannot share any work.
+    """
+
+    return [pbkdf2(secret, salt, iterations, length) for salt in salts]
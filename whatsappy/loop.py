@@ -0,0 +1,188 @@
+from select import select
+from time import time
+
+import os
+import heapq
+import logging
+import collections
+
+# Logger instance
+logger = logging.getLogger(__name__)
+
+
+class Timer(object):
+    """
+    Handle for a callback scheduled with Loop.call_later.
+    """
+
+    __slots__ = ("when", "callback", "args", "cancelled")
+
+    def __init__(self, when, callback, args):
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def __lt__(self, other):
+        return self.when < other.when
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class Loop(object):
+    """
+    Event loop that drives many clients from a single thread. It waits until
+    a client socket is readable or writable, a timer expires, or another
+    thread wakes it up, and never polls.
+
+    Connected clients are added to a loop, which then handles incoming data
+    and writes queued frames. Clients schedule their own timers, such as keep
+    alive pings, via call_later.
+
+    Exceptions raised while handling a client remove the client from the loop
+    and are passed to 'on_error', if set. Exceptions of other callbacks, such
+    as readers and timers, are logged if 'on_error' is set, so one failing
+    callback does not stop the loop. Otherwise, they are raised.
+
+    Other file objects can be watched with add_reader.
+    """
+
+    def __init__(self, on_error=None):
+        self.clients = []
+        self.readers = {}
+        self.timers = []
+        self.on_error = on_error
+
+        self.running = False
+
+        # Callbacks from other threads, and pipe to wake up the loop. The file
+        # objects close the pipe when the loop is garbage collected.
+        self.pending = collections.deque()
+        self.wakeup = [os.fdopen(fd, mode, 0) for fd, mode in zip(
+            os.pipe(), ("rb", "wb"))]
+
+        self.add_reader(self.wakeup[0], self._wakeup)
+
+    def add(self, client):
+        if client not in self.clients:
+            self.clients.append(client)
+
+        client.loop = self
+
+    def remove(self, client):
+        self.clients.remove(client)
+        client.loop = None
+
+    def add_reader(self, fileobj, callback):
+        """
+        Call 'callback' without arguments whenever 'fileobj' is readable.
+        """
+
+        self.readers[fileobj] = callback
+
+    def remove_reader(self, fileobj):
+        del self.readers[fileobj]
+
+    def call_later(self, delay, callback, *args):
+        """
+        Call 'callback' with the given arguments after 'delay' seconds. Returns
+        a Timer that can be cancelled.
+        """
+
+        timer = Timer(time() + delay, callback, args)
+        heapq.heappush(self.timers, timer)
+
+        return timer
+
+    def call_soon_threadsafe(self, callback, *args):
+        """
+        Call 'callback' with the given arguments from the loop thread. This is
+        the only method that may be called from other threads, e.g. to send
+        messages.
+        """
+
+        self.pending.append((callback, args))
+        os.write(self.wakeup[1].fileno(), "\x00")
+
+    def _wakeup(self):
+        os.read(self.wakeup[0].fileno(), 4096)
+
+        while self.pending:
+            callback, args = self.pending.popleft()
+            self._call(callback, args)
+
+    def _call(self, callback, args):
+        try:
+            callback(*args)
+        except Exception as e:
+            # Route errors of client methods to the client
+            client = getattr(callback, "__self__", None)
+
+            if client in self.clients:
+                return self._error(client, e)
+
+            if not self.on_error:
+                raise
+
+            logger.exception("Callback %r failed", callback)
+
+    def _error(self, client, exception):
+        logger.debug("Removing client %s: %s", client.number, exception)
+
+        if client in self.clients:
+            self.remove(client)
+
+        if not self.on_error:
+            raise exception
+
+        self.on_error(client, exception)
+
+    def run_once(self, timeout=None):
+        """
+        Wait for at most 'timeout' seconds, or until the next timer expires,
+        and handle all events once. If both are None, wait for the next event.
+        """
+
+        if self.timers:
+            delay = max(0, self.timers[0].when - time())
+            timeout = delay if timeout is None else min(timeout, delay)
+
+        clients = [
+            client for client in self.clients if client.socket is not None]
+        writable = [client for client in clients if client.outbox]
+
+        readable, writable, _ = select(
+            clients + self.readers.keys(), writable, [], timeout)
+
+        for client in writable:
+            self._call(client.flush, ())
+
+        for fileobj in readable:
+            if fileobj in self.readers:
+                self._call(self.readers[fileobj], ())
+            elif fileobj.loop is self:
+                self._call(fileobj.receive, ())
+
+        # Handle expired timers
+        now = time()
+
+        while self.timers and self.timers[0].when <= now:
+            timer = heapq.heappop(self.timers)
+
+            if not timer.cancelled:
+                self._call(timer.callback, timer.args)
+
+    def run(self, forever=False):
+        """
+        Run the loop until there are no clients left, or stop is called. If
+        'forever' is True, keep running without clients.
+        """
+
+        self.running = True
+
+        while self.running and (forever or self.clients):
+            self.run_once()
+
+    def stop(self):
+        self.running = False
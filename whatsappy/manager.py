@@ -0,0 +1,409 @@
+from whatsappy.client import Client
+from whatsappy.callbacks import Callback, CallbackIndex
+from whatsappy.loop import Loop
+from whatsappy.exceptions import Error
+
+from multiprocessing import Pipe, Process
+from select import select
+from cPickle import PicklingError
+from hashlib import md5
+
+import bisect
+import logging
+import collections
+
+# Number of points per worker on the hash ring
+REPLICAS = 64
+
+# Logger instance
+logger = logging.getLogger(__name__)
+
+
+class HashRing(object):
+    """
+    Consistent hash ring. Keys are mapped to the first node clockwise on the
+    ring, so adding or removing a node only moves the keys of that node.
+    """
+
+    def __init__(self, nodes=None, replicas=REPLICAS):
+        self.replicas = replicas
+
+        self.points = []
+        self.ring = {}
+
+        for node in nodes or []:
+            self.add(node)
+
+    def _hash(self, key):
+        return int(md5(str(key)).hexdigest()[:8], 16)
+
+    def add(self, node):
+        for i in xrange(self.replicas):
+            point = self._hash("%s-%d" % (node, i))
+
+            self.ring[point] = node
+            bisect.insort(self.points, point)
+
+    def remove(self, node):
+        for i in xrange(self.replicas):
+            point = self._hash("%s-%d" % (node, i))
+
+            del self.ring[point]
+            self.points.remove(point)
+
+    def get(self, key):
+        if not self.points:
+            return None
+
+        index = bisect.bisect(self.points, self._hash(key)) % len(self.points)
+        return self.ring[self.points[index]]
+
+
+class Worker(object):
+    """
+    Drives the clients of one worker process with a single Loop, and executes
+    commands received from the manager over 'connection'.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+
+        self.clients = {}
+        self.forward = set()
+
+        self.nodes = 0
+        self.calls = 0
+        self.errors = 0
+
+        self.loop = Loop(on_error=self.on_error)
+        self.loop.add_reader(connection, self.on_command)
+
+    def _send(self, *message):
+        self.connection.send(message)
+
+    def _forward(self, number, client, name):
+        def forward(node):
+            self.nodes += 1
+            self._send("node", number, node)
+
+        client.register_callback(Callback(name, forward))
+
+    def on_error(self, client, exception):
+        self.errors += 1
+        self.clients.pop(client.number, None)
+
+        self._send("error", client.number, exception)
+
+    def on_command(self):
+        try:
+            command = self.connection.recv()
+        except EOFError:
+            command = ("stop", )
+
+        getattr(self, "do_" + command[0])(*command[1:])
+
+    def do_add(self, number, secret, nickname, auth_blob, host, port):
+        client = Client(number, secret, nickname, auth_blob, host, port)
+
+        for name in self.forward:
+            self._forward(number, client, name)
+
+        self.clients[number] = client
+
+        try:
+            client.connect(block=False)
+        except Error as e:
+            self.on_error(client, e)
+        else:
+            self.loop.add(client)
+
+    def do_remove(self, number):
+        client = self.clients.pop(number, None)
+
+        if client is not None:
+            if client in self.loop.clients:
+                self.loop.remove(client)
+
+            client.disconnect()
+
+    def do_forward(self, names):
+        for name in set(names) - self.forward:
+            for number, client in self.clients.iteritems():
+                self._forward(number, client, name)
+
+            self.forward.add(name)
+
+    def do_call(self, sequence, number, method, args):
+        self.calls += 1
+
+        client = self.clients.get(number)
+
+        # Errors are returned to the caller, and should not stop the worker
+        if client is None:
+            result = Error("Unknown account: %s" % number)
+        else:
+            try:
+                result = getattr(client, method)(*args)
+            except Exception as e:
+                logger.debug("Call of %s failed: %s", method, e)
+                result = e
+
+        # Results such as requests and trackers hold functions, which cannot
+        # be sent to the manager
+        try:
+            self._send("result", sequence, result)
+        except (PicklingError, TypeError) as e:
+            self._send("result", sequence, Error(
+                "Unable to return result of %s: %s" % (method, e)))
+
+    def do_stats(self, sequence):
+        self._send("result", sequence, {
+            "accounts": len(self.clients),
+            "connected": sum(
+                1 for client in self.clients.itervalues()
+                if client.account_info is not None),
+            "nodes": self.nodes,
+            "calls": self.calls,
+            "errors": self.errors
+        })
+
+    def do_stop(self):
+        for number in self.clients.keys():
+            self.do_remove(number)
+
+        self.loop.stop()
+
+    def run(self):
+        try:
+            self.loop.run(forever=True)
+        except KeyboardInterrupt:
+            pass
+
+
+def run_worker(connection):
+    """
+    Entry point of a worker process.
+    """
+
+    Worker(connection).run()
+
+
+class Manager(object):
+    """
+    Shards accounts across a number of worker processes. Each worker drives
+    its clients with one event loop. Accounts are assigned to workers using
+    consistent hashing on the number.
+
+    Received nodes are forwarded to the manager for the names of registered
+    callbacks, and the callbacks are executed in the manager process when
+    poll or run is called. Client methods are executed in the worker of the
+    account via call, and should return results that can be pickled.
+
+    If a worker dies, its accounts are removed, and reported to 'on_error'.
+    New accounts are assigned to the remaining workers.
+    """
+
+    def __init__(self, workers=4, on_error=None):
+        self.workers = []
+        self.connections = []
+        self.ring = HashRing(range(workers))
+
+        self.accounts = {}
+        self.callbacks = collections.defaultdict(CallbackIndex)
+        self.on_error = on_error
+
+        self.sequence = 0
+        self.results = {}
+        self.events = collections.deque()
+
+        # Indexes of workers that died
+        self.dead = set()
+
+        self.running = False
+
+        for _ in xrange(workers):
+            parent, child = Pipe()
+
+            worker = Process(target=run_worker, args=(child, ))
+            worker.daemon = True
+            worker.start()
+
+            # Only the worker should hold its end, so the manager reads EOF
+            # when the worker dies
+            child.close()
+
+            self.workers.append(worker)
+            self.connections.append(parent)
+
+    def _send(self, index, *message):
+        if index is None or index in self.dead:
+            raise Error("Worker %s is not running" % index)
+
+        try:
+            self.connections[index].send(message)
+        except IOError:
+            self._died(index)
+            raise Error("Worker %s is not running" % index)
+
+    def _receive(self, connection):
+        try:
+            message = connection.recv()
+        except (EOFError, IOError):
+            return self._died(self.connections.index(connection))
+
+        if message[0] == "result":
+            self.results[message[1]] = message[2]
+        else:
+            self.events.append(message)
+
+    def _request(self, index, command, *args):
+        self.sequence += 1
+        sequence = self.sequence
+
+        self._send(index, command, sequence, *args)
+
+        # Wait for the result. Other messages are queued for poll.
+        while sequence not in self.results:
+            if index in self.dead:
+                raise Error("Worker %s died" % index)
+
+            self._receive(self.connections[index])
+
+        result = self.results.pop(sequence)
+
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def _died(self, index):
+        if index in self.dead:
+            return
+
+        logger.warning("Worker %d died", index)
+
+        self.dead.add(index)
+        self.ring.remove(index)
+        self.events.append(("died", index))
+
+    def _live(self):
+        return [
+            index for index in xrange(len(self.connections))
+            if index not in self.dead]
+
+    def _dispatch(self, event):
+        if event[0] == "node":
+            number, node = event[1:]
+
+            for key in (number, None):
+                for callback in self.callbacks[key].match(node):
+                    if callback.test(node):
+                        callback(node)
+        elif event[0] == "error":
+            number, exception = event[1:]
+
+            logger.debug("Account %s failed: %s", number, exception)
+            self.accounts.pop(number, None)
+
+            if self.on_error:
+                self.on_error(number, exception)
+        elif event[0] == "died":
+            index = event[1]
+
+            for number, worker in self.accounts.items():
+                if worker == index:
+                    self.events.append((
+                        "error", number, Error("Worker %d died" % index)))
+
+    def worker(self, number):
+        """
+        Return the index of the worker for a given number.
+        """
+
+        return self.ring.get(number)
+
+    def add_account(self, number, secret, nickname=None, auth_blob=None,
+                    host=None, port=None):
+        index = self.worker(number)
+
+        self.accounts[number] = index
+        self._send(
+            index, "add", number, secret, nickname, auth_blob, host, port)
+
+    def remove_account(self, number):
+        index = self.accounts.pop(number)
+        self._send(index, "remove", number)
+
+    def register_callback(self, number, *callbacks):
+        """
+        Register callbacks for the account with the given number, or for all
+        accounts if number is None.
+        """
+
+        names = set()
+
+        for callback in callbacks:
+            self.callbacks[number].add(callback)
+            names.add(callback.name)
+
+        for index in self._live():
+            self._send(index, "forward", names)
+
+    def unregister_callback(self, number, *callbacks):
+        for callback in callbacks:
+            self.callbacks[number].remove(callback)
+
+    def call(self, number, method, *args):
+        """
+        Call a client method for the account with the given number, in its
+        worker process. Returns the result.
+        """
+
+        return self._request(self.accounts[number], "call", number, method, args)
+
+    def message(self, number, to, text):
+        return self.call(number, "message", to, text)
+
+    def stats(self):
+        """
+        Return a list with the load statistics of every worker, or None for
+        workers that died.
+        """
+
+        return [
+            None if index in self.dead else self._request(index, "stats")
+            for index in xrange(len(self.connections))]
+
+    def poll(self, timeout=0):
+        """
+        Wait at most 'timeout' seconds for events from the workers, and
+        execute callbacks for the received nodes.
+        """
+
+        if not self.events:
+            readable, _, _ = select(
+                [self.connections[index] for index in self._live()], [], [],
+                timeout)
+
+            for connection in readable:
+                index = self.connections.index(connection)
+
+                # A dead worker's connection stays readable
+                while index not in self.dead and connection.poll():
+                    self._receive(connection)
+
+        while self.events:
+            self._dispatch(self.events.popleft())
+
+    def run(self):
+        self.running = True
+
+        while self.running:
+            self.poll(timeout=1)
+
+    def stop(self):
+        self.running = False
+
+        for index, worker in enumerate(self.workers):
+            if index not in self.dead:
+                self._send(index, "stop")
+            worker.join()
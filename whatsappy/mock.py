@@ -0,0 +1,376 @@
+from whatsappy.stream import Reader, Writer, MessageIncomplete, EndOfStream, \
+    STREAM_HEADER
+from whatsappy.encryption import Encryption, AuthBlobEncryption
+from whatsappy.exceptions import EncryptionError
+from whatsappy.node import Node
+from whatsappy.loop import Loop
+from whatsappy import utils
+
+import os
+import errno
+import socket
+import logging
+import threading
+import collections
+
+# Domain of user Jabber IDs
+SERVER = "s.whatsapp.net"
+
+# Logger instance
+logger = logging.getLogger(__name__)
+
+
+class ServerEncryption(Encryption):
+    """
+    Encryption for the server side of a session. The server derives the same
+    keys as the client, but uses them in the opposite direction.
+    """
+
+    def __init__(self, secret, challenge):
+        super(ServerEncryption, self).__init__(secret, challenge)
+
+        self.keys = [self.keys[2], self.keys[3], self.keys[0], self.keys[1]]
+        self.rc4_in, self.rc4_out = self.rc4_out, self.rc4_in
+        self.mac_in, self.mac_out = self.mac_out, self.mac_in
+
+
+class ServerAuthBlobEncryption(ServerEncryption, AuthBlobEncryption):
+    """
+    Server side of a session resumed with an auth blob.
+    """
+
+    pass
+
+
+class Connection(object):
+    """
+    Server side of a client connection. It provides the same interface as a
+    Client, so it can be driven by a Loop.
+    """
+
+    def __init__(self, server, sock):
+        self.server = server
+        self.socket = sock
+        self.loop = None
+
+        self.number = None
+        self.challenge = None
+        self.ping_timer = None
+        self.counter = 0
+
+        self.reader = Reader()
+        self.writer = Writer()
+        self.outbox = []
+
+        # Number of bytes of the stream header still to be skipped
+        self.header = len(STREAM_HEADER)
+
+    def fileno(self):
+        return self.socket.fileno()
+
+    def receive(self):
+        try:
+            data = self.socket.recv(65536)
+        except socket.error as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            data = ""
+
+        if not data:
+            return self.close()
+
+        if self.header:
+            skip = min(self.header, len(data))
+            data = data[skip:]
+            self.header -= skip
+
+        self.reader.data(data)
+
+        while self.socket is not None:
+            try:
+                node, _ = self.reader.read()
+            except MessageIncomplete:
+                break
+            except EndOfStream:
+                return self.close()
+
+            self.server.counts[node.name] += 1
+
+            handler = getattr(self, "on_" + node.name.replace(":", "_"), None)
+
+            if handler is not None:
+                handler(node)
+
+    def flush(self):
+        if not self.outbox or self.socket is None:
+            return
+
+        buf = bytearray().join(self.outbox)
+
+        # The socket does not block, so keep what it does not accept
+        try:
+            written = self.socket.send(buf)
+        except socket.error as e:
+            if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return self.close()
+            written = 0
+
+        self.outbox = [buf[written:]] if written < len(buf) else []
+
+    def write(self, node):
+        self.outbox.append(self.writer.node(node, copy_plain=False)[0])
+
+    def close(self):
+        if self.socket is None:
+            return
+
+        self.socket.close()
+        self.socket = None
+
+        if self.ping_timer is not None:
+            self.ping_timer.cancel()
+
+        if self.loop is not None:
+            self.loop.remove(self)
+
+        if self.server.connections.get(self.number) is self:
+            del self.server.connections[self.number]
+
+    def _id(self, prefix):
+        self.counter += 1
+        return "%s-%d" % (prefix, self.counter)
+
+    def _failure(self):
+        self.write(Node("failure", children=[Node("not-authorized")]))
+
+    def ping(self):
+        self.write(Node(
+            "iq", type="get", id=self._id("ping"), children=[Node("ping")]))
+
+        self.ping_timer = self.loop.call_later(
+            self.server.ping_interval, self.ping)
+
+    def on_auth(self, node):
+        self.number = node["user"]
+
+        if self.number not in self.server.accounts:
+            return self._failure()
+
+        # Resume the session of an auth blob issued by this server. The data
+        # starts with the MAC of an empty payload.
+        blob = self.server.blobs.get(self.number)
+
+        if blob is not None and node.data and \
+                node.data[4:].startswith(self.number + blob):
+            encryption = ServerAuthBlobEncryption(
+                self.server.accounts[self.number], blob)
+
+            try:
+                encryption.decrypt(node.data[:4])
+            except EncryptionError:
+                pass
+            else:
+                self.server.resumes += 1
+                return self._success(encryption)
+
+        # Other logins get a challenge
+        self.challenge = os.urandom(20)
+        self.write(Node("challenge", data=self.challenge))
+
+    def on_response(self, node):
+        if self.challenge is None:
+            return self._failure()
+
+        encryption = ServerEncryption(
+            self.server.accounts[self.number], self.challenge)
+
+        # The client sends the MAC before the data
+        try:
+            data = encryption.decrypt(node.data[4:] + node.data[:4])
+        except EncryptionError:
+            data = None
+
+        if data is None or not data.startswith(self.number + self.challenge):
+            return self._failure()
+
+        self._success(encryption)
+
+    def _success(self, encryption):
+        self.reader.decrypt = encryption.decrypt
+        self.writer.encrypt = encryption.encrypt_into
+
+        # Replace a previous connection of the same account
+        previous = self.server.connections.get(self.number)
+
+        if previous is not None:
+            previous.close()
+
+        self.server.connections[self.number] = self
+        self.server.logins += 1
+
+        blob = self.server.blobs[self.number] = os.urandom(20)
+
+        self.write(Node(
+            "success", status="active", kind="free", t=utils.timestamp(),
+            creation=utils.timestamp(), expiration="4444444444", data=blob))
+
+        for queued in self.server.backlog.pop(self.number, []):
+            self.write(queued)
+
+        if self.server.ping_interval:
+            self.ping_timer = self.loop.call_later(
+                self.server.ping_interval, self.ping)
+
+    def on_message(self, node):
+        sender = self.number + "@" + SERVER
+        body = node.child("body")
+
+        if self.server.receipts:
+            self.write(Node(
+                "receipt", id=node["id"], t=utils.timestamp(),
+                **{"from": node["to"]}))
+
+        # Deliver to a connected recipient
+        recipient = self.server.connections.get(node["to"].partition("@")[0])
+
+        if recipient is not None and recipient is not self:
+            message = Node(
+                "message", type=node["type"], id=node["id"],
+                t=utils.timestamp(), children=node.children,
+                **{"from": sender})
+
+            recipient.write(message)
+
+        if self.server.echo and body is not None:
+            self.write(Node(
+                "message", type="text", id="echo-" + node["id"],
+                t=utils.timestamp(), children=[body],
+                **{"from": node["to"]}))
+
+    def on_iq(self, node):
+        if node["type"] not in ("get", "set"):
+            return
+
+        result = Node("iq", type="result", id=node["id"], **{"from": SERVER})
+        child = node.first_child()
+
+        if child is None or child.name == "ping":
+            pass
+        elif child.name == "query":
+            result.add(Node("query", seconds="0"))
+        elif child.name == "sync":
+            users = [
+                Node("user", user.data, jid=user.data[1:] + "@" + SERVER)
+                for user in child.children]
+
+            result.add(Node(
+                "sync", sid=child["sid"], index=child["index"],
+                last=child["last"], children=[Node("in", children=users)]))
+        elif child.name == "props":
+            result.add(Node("props", version="1"))
+
+        self.write(result)
+
+
+class MockServer(object):
+    """
+    In-process server that speaks the WhatsApp protocol, for testing and load
+    testing clients on a single machine. It runs an event loop in a thread of
+    its own, started by start.
+
+    The server issues a challenge, authenticates accounts given in 'accounts',
+    a dictionary of numbers to secrets, and answers pings, last seen queries
+    and contact syncs. Messages are acknowledged with a receipt if 'receipts'
+    is True, delivered to the recipient if connected, and echoed back if
+    'echo' is True. If 'ping_interval' is set, the server pings clients.
+
+    Nodes queued with queue are delivered after the next login of an account,
+    to replay an offline backlog. Clients that log in with the auth blob of
+    their previous login resume their session without a challenge.
+    """
+
+    def __init__(self, accounts=None, host="127.0.0.1", port=0, echo=True,
+                 receipts=True, ping_interval=None):
+        self.accounts = dict(accounts or {})
+        self.echo = echo
+        self.receipts = receipts
+        self.ping_interval = ping_interval
+
+        self.connections = {}
+        self.backlog = collections.defaultdict(list)
+        self.blobs = {}
+
+        # Statistics
+        self.counts = collections.Counter()
+        self.logins = 0
+        self.resumes = 0
+
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind((host, port))
+        self.socket.listen(128)
+
+        self.host, self.port = self.socket.getsockname()
+
+        self.loop = Loop(on_error=self.on_error)
+        self.loop.add_reader(self.socket, self.accept)
+        self.thread = None
+
+    def add_account(self, number, secret):
+        self.accounts[number] = secret
+
+    def queue(self, number, node):
+        """
+        Queue a node for delivery after the next login of an account. Messages
+        are marked as offline messages.
+        """
+
+        if node.name == "message" and not node.has_child("offline"):
+            node.add(Node("offline"))
+
+        self.backlog[number].append(node)
+
+    def disconnect(self, number):
+        """
+        Close the connection of an account, as if the network failed.
+        """
+
+        def close():
+            connection = self.connections.get(number)
+
+            if connection is not None:
+                connection.close()
+
+        self.loop.call_soon_threadsafe(close)
+
+    def accept(self):
+        sock, _ = self.socket.accept()
+        sock.setblocking(0)
+        self.loop.add(Connection(self, sock))
+
+    def on_error(self, connection, exception):
+        logger.debug(
+            "Connection of %s failed: %s", connection.number, exception)
+        connection.close()
+
+    def start(self):
+        self.thread = threading.Thread(
+            target=self.loop.run, kwargs={"forever": True})
+        self.thread.daemon = True
+        self.thread.start()
+
+        return self
+
+    def _stop(self):
+        for connection in list(self.loop.clients):
+            connection.close()
+
+        self.loop.remove_reader(self.socket)
+        self.socket.close()
+        self.loop.stop()
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self._stop)
+
+        if self.thread is not None:
+            self.thread.join()
@@ -7,7 +7,30 @@ XML_ENT = {
     '"': "&quot;"
 }
 
-class Node(MutableMapping):
+# Nodes with more children than this index their children by name
+INDEX_THRESHOLD = 8
+
+class Node(object):
+    """
+    Protocol tree element. The attributes are accessed through the dictionary
+    interface of the node.
+
+    Nodes use slots, and the attributes dictionary and children list are only
+    allocated when a node has attributes or children. Most received nodes are
+    small, so this saves a lot of memory for clients that keep many of them.
+
+    Large nodes, such as sync results, build an index of their children by
+    name on the first lookup. The index is updated by add and remove. The
+    children property hands out the list itself, which may be changed in any
+    way, so it drops the index. Keeping the list and changing it after a
+    lookup is only noticed if the number of children changes.
+    """
+
+    __slots__ = ("name", "data", "_attributes", "_children", "_index")
+
+    # Nodes compare by attributes, like other mappings
+    __hash__ = None
+
     def __init__(self, tag, data=None, children=None, **kwargs):
         """
         Construct a new node. Any kwargs are assumed to be attributes, therefore
@@ -16,52 +39,241 @@ class Node(MutableMapping):
 
         self.name = tag
         self.data = data
-        self.attributes = kwargs
-
-        # Child nodes
-        if children:
-            if type(children) == list:
-                self.children = children
-            elif isinstance(children, Node):
-                self.children = list(children)
-            else:
-                raise ValueError("Expected Node as child")
+        self._attributes = kwargs or None
+
+        # Child nodes. A node without attributes is falsy, so test for a
+        # single child before testing for an empty value.
+        if type(children) is list:
+            self._children = children or None
+        elif children is None:
+            self._children = None
+        elif isinstance(children, Node):
+            self._children = [children]
+        elif not children:
+            self._children = None
         else:
-            self.children = []
+            raise ValueError("Expected Node as child")
+
+        self._index = None
+
+    @property
+    def attributes(self):
+        if self._attributes is None:
+            self._attributes = {}
+        return self._attributes
+
+    @attributes.setter
+    def attributes(self, attributes):
+        self._attributes = attributes or None
+
+    @property
+    def children(self):
+        if self._children is None:
+            self._children = []
+
+        self._index = None
+        return self._children
+
+    @children.setter
+    def children(self, children):
+        self._children = children or None
+        self._index = None
+
+    def __getstate__(self):
+        return (self.name, self.data, self._attributes, self._children)
+
+    def __setstate__(self, state):
+        self.name, self.data, self._attributes, self._children = state
+        self._index = None
 
     def __iter__(self):
-        return iter(self.attributes)
+        return iter(self._attributes or ())
 
     def __len__(self):
-        return len(self.attributes)
+        return len(self._attributes) if self._attributes else 0
 
     def __getitem__(self, key):
-        return self.attributes[key]
+        if self._attributes is None:
+            raise KeyError(key)
+        return self._attributes[key]
 
     def __setitem__(self, key, value):
         self.attributes[key] = value
 
     def __delitem__(self, key):
-        del self.attributes[key]
+        if self._attributes is None:
+            raise KeyError(key)
+        del self._attributes[key]
 
     def __contains__(self, key):
-        return key in self.attributes
+        return self._attributes is not None and key in self._attributes
+
+    def __eq__(self, other):
+        if not isinstance(other, MutableMapping):
+            return NotImplemented
+        return dict(self.items()) == dict(other.items())
+
+    def __ne__(self, other):
+        return not (self == other)
+
+    def get(self, key, default=None):
+        if self._attributes is None:
+            return default
+        return self._attributes.get(key, default)
 
     def keys(self):
-        return self.attributes.keys()
+        return self._attributes.keys() if self._attributes else []
+
+    def values(self):
+        return self._attributes.values() if self._attributes else []
+
+    def items(self):
+        return self._attributes.items() if self._attributes else []
+
+    def iterkeys(self):
+        return iter(self)
+
+    def itervalues(self):
+        return iter(self.values())
+
+    def iteritems(self):
+        return iter(self.items())
+
+    def pop(self, key, *default):
+        if self._attributes is None:
+            if default:
+                return default[0]
+            raise KeyError(key)
+        return self._attributes.pop(key, *default)
+
+    def popitem(self):
+        if not self._attributes:
+            raise KeyError("popitem(): node has no attributes")
+        return self._attributes.popitem()
+
+    def setdefault(self, key, default=None):
+        return self.attributes.setdefault(key, default)
+
+    def update(self, *args, **kwargs):
+        self.attributes.update(*args, **kwargs)
+
+    def clear(self):
+        self._attributes = None
+
+    def _names(self):
+        """
+        Return the index of children by name, or None if the node has too few
+        children to be worth indexing.
+        """
+
+        children = self._children
+
+        if not children or len(children) <= INDEX_THRESHOLD:
+            return None
+
+        if self._index is None or self._index[0] != len(children):
+            names = {}
+
+            for child in children:
+                names.setdefault(child.name, []).append(child)
+
+            self._index = (len(children), names)
+
+        return self._index[1]
 
     def add(self, child):
-        self.children.append(child)
+        children = self._children
+
+        if children is None:
+            children = self._children = []
+
+        children.append(child)
+
+        # Update the index, if it is in sync
+        if self._index is not None:
+            count, names = self._index
+
+            if count == len(children) - 1:
+                names.setdefault(child.name, []).append(child)
+                self._index = (count + 1, names)
+            else:
+                self._index = None
 
     def remove(self, child):
-        self.children.remove(child)
+        children = self._children or []
+
+        # Nodes compare by attributes, so look for the child itself first
+        for i, other in enumerate(children):
+            if other is child:
+                break
+        else:
+            i = children.index(child)
+
+        child = children.pop(i)
+
+        # Update the index, if it is in sync
+        if self._index is not None:
+            count, names = self._index
+
+            if count == len(children) + 1:
+                named = names[child.name]
+
+                for i, other in enumerate(named):
+                    if other is child:
+                        del named[i]
+                        break
+
+                if not named:
+                    del names[child.name]
+
+                self._index = (count - 1, names)
+            else:
+                self._index = None
 
     def child(self, name):
-        for child in self.children:
+        children = self._children
+
+        if not children:
+            return None
+
+        if len(children) > INDEX_THRESHOLD:
+            named = self._names().get(name)
+            return named[0] if named else None
+
+        for child in children:
             if child.name == name:
                 return child
         return None
 
+    def children_by_name(self, name):
+        """
+        Return a list of all children with the given name, in order.
+        """
+
+        names = self._names()
+
+        if names is not None:
+            return list(names.get(name, ()))
+
+        return [
+            child for child in self._children or () if child.name == name]
+
+    def first_child(self):
+        """
+        Return the first child, or None. Unlike the children property, this
+        does not allocate a list for nodes without children.
+        """
+
+        return self._children[0] if self._children else None
+
+    def iter_children(self):
+        """
+        Return an iterator over the children, without allocating a list for
+        nodes without children.
+        """
+
+        return iter(self._children or ())
+
     def has_child(self, name):
         return self.child(name) is not None
 
@@ -92,21 +304,21 @@ class Node(MutableMapping):
         # Opening tag + attributes
         xml = "%s<%s" % (prefix, self.name)
 
-        for attribute, value in self.attributes.iteritems():
+        for attribute, value in self.iteritems():
             xml += " %s=\"%s\"" % (attribute, self.escape(value))
 
         xml += ">"
 
-        if self.data or self.children:
+        if self.data or self._children:
             # Data, with extra indent.
             if self.data:
                 xml += "\n%s%s%s\n" % (prefix, indent * " ", self.escape(self.data))
 
             # Children
-            if self.children:
+            if self._children:
                 xml += "\n"
 
-                for child in self.children:
+                for child in self._children:
                     child = child.to_xml(indent=indent, level=level + 1)
                     xml += "%s\n" % (child)
 
@@ -119,4 +331,9 @@ class Node(MutableMapping):
         return xml
 
     def __repr__(self):
-        return "<%s (%d)>" % (self.name, len(self.children))
\ No newline at end of file
+        return "<%s (%d)>" % (self.name, len(self._children or ()))
+
+
+# Nodes implement the mapping interface, but cannot inherit from it because
+# the base classes have no slots.
+MutableMapping.register(Node)
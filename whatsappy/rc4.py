@@ -1,8 +1,14 @@
+from binascii import hexlify, unhexlify
+
+
 class RC4Engine(object):
     """
     Python port of the RC4 Engine, which seems to be an obfuscated version of
     the RC4Engine class found in the Bouncy Castle Crypto API
     (http://bouncycastle.org/java.html)
+
+    The keystream for a whole frame is generated first, and then XOR'ed with
+    the frame at once using long integer arithmetic.
     """
 
     def __init__(self, key):
@@ -19,15 +25,89 @@ class RC4Engine(object):
             j = (j + self.box[i] + ord(key[i % len(key)])) % 256
             self.box[i], self.box[j] = self.box[j], self.box[i]
 
+    @classmethod
+    def from_state(cls, state):
+        """
+        Construct an engine from a state returned by state.
+        """
+
+        engine = cls.__new__(cls)
+        engine.box = list(state[0])
+        engine.x = state[1]
+        engine.y = state[2]
+
+        return engine
+
+    def state(self):
+        """
+        Return a snapshot of the engine state, as a tuple of the permutation
+        and the two indices.
+        """
+
+        return tuple(self.box), self.x, self.y
+
+    def keystream(self, length):
+        """
+        Generate the next 'length' bytes of keystream, as a bytearray.
+        """
+
+        box = self.box
+        x = self.x
+        y = self.y
+
+        out = bytearray(length)
+
+        for i in xrange(length):
+            x = (x + 1) & 0xFF
+            a = box[x]
+            y = (y + a) & 0xFF
+            b = box[y]
+
+            box[x] = b
+            box[y] = a
+
+            out[i] = box[(a + b) & 0xFF]
+
+        self.x = x
+        self.y = y
+
+        return out
+
+    def skip(self, length):
+        """
+        Advance the engine by 'length' bytes, without producing output. This
+        is equivalent to processing 'length' bytes and discarding the result.
+        """
+
+        box = self.box
+        x = self.x
+        y = self.y
+
+        for _ in xrange(length):
+            x = (x + 1) & 0xFF
+            a = box[x]
+            y = (y + a) & 0xFF
+
+            box[x] = box[y]
+            box[y] = a
+
+        self.x = x
+        self.y = y
+
     def process_bytes(self, data):
-        out = []
+        length = len(data)
+
+        if not length:
+            return ""
 
-        for d in data:
-            self.x = (self.x + 1) % 256
-            self.y = (self.y + self.box[self.x]) % 256
+        keystream = self.keystream(length)
+        output = int(hexlify(data), 16) ^ int(hexlify(keystream), 16)
 
-            self.box[self.x], self.box[self.y] = self.box[self.y], self.box[self.x]
+        return unhexlify("%0*x" % (length * 2, output))
 
-            out.append(chr( ord(d) ^ self.box[(self.box[self.x] + self.box[self.y]) % 256] ))
+    def process_into(self, buf, start, end):
+        """
+        Process the bytes buf[start:end] of a bytearray in place.
+        """
 
-        return "".join(out)
+        buf[start:end] = self.process_bytes(memoryview(buf)[start:end])
@@ -0,0 +1,204 @@
+from time import time
+
+import itertools
+import collections
+
+# Priorities, from high to low. Stanzas with a high priority are never queued.
+HIGH, NORMAL, LOW = range(3)
+
+# Priority of stanzas by name. Other stanzas have a normal priority.
+PRIORITIES = {
+    "receipt": HIGH,
+    "ack": HIGH,
+    "presence": HIGH,
+    "message": LOW
+}
+
+# Default sending rate in stanzas per second, and the number of stanzas that
+# can be sent at once
+RATE = 100.0
+BURST = 200
+
+# Bounds of the rate. The rate increases by RATE_INCREASE for every timely
+# acknowledgement, and is multiplied by RATE_DECREASE when the server
+# throttles, or when an acknowledgement takes more than SLOW_ACK seconds.
+MIN_RATE = 5.0
+MAX_RATE = 1000.0
+RATE_INCREASE = 1.0
+RATE_DECREASE = 0.5
+SLOW_ACK = 5.0
+
+# Error codes and conditions of servers that ask clients to slow down. Other
+# errors, such as a 404 for a hidden last seen time, do not affect the rate.
+THROTTLE_CODES = frozenset(("429", "503"))
+THROTTLE_CONDITIONS = frozenset((
+    "rate-overlimit", "resource-constraint", "policy-violation"))
+
+# Maximum number of sent stanzas awaiting an acknowledgement to track
+TRACK_SIZE = 10000
+
+
+def priority(node):
+    """
+    Return the priority of a stanza. Responses, such as receipts, acks and
+    replies to pings, have a high priority.
+    """
+
+    if node.name == "iq" and node.get("type") in ("result", "error"):
+        return HIGH
+    return PRIORITIES.get(node.name, NORMAL)
+
+
+def throttled(node):
+    """
+    Return True if a received stanza asks the client to slow down, i.e. a
+    stream error, or an error with a throttling code or condition.
+    """
+
+    if node.name == "stream:error":
+        return True
+
+    if node.get("type") != "error":
+        return False
+
+    error = node.child("error")
+
+    if error is None:
+        return False
+
+    if error.get("code") in THROTTLE_CODES or \
+            error.get("text") in THROTTLE_CONDITIONS:
+        return True
+
+    return any(
+        child.name in THROTTLE_CONDITIONS
+        for child in error.iter_children())
+
+
+class Scheduler(object):
+    """
+    Token bucket that paces outgoing stanzas. Tokens are added at 'rate' per
+    second, up to 'burst' tokens, and every stanza takes one token. Queued
+    stanzas are sent by priority, and in order within a priority.
+
+    The rate adapts to the server: it increases additively when stanzas are
+    acknowledged in time, and decreases multiplicatively when the server
+    throttles, and on slow acknowledgements.
+    """
+
+    def __init__(self, rate=RATE, burst=BURST, min_rate=MIN_RATE,
+                 max_rate=MAX_RATE):
+        self.rate = float(rate)
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+
+        self.tokens = float(burst)
+        self.updated = time()
+
+        self.queues = [collections.deque() for _ in (NORMAL, LOW)]
+
+        # Send time of stanzas awaiting an acknowledgement, by id
+        self.sent = collections.OrderedDict()
+        self.backoffs = 0
+
+    def __len__(self):
+        """
+        Return the number of queued stanzas.
+        """
+
+        return sum(len(queue) for queue in self.queues)
+
+    def __iter__(self):
+        """
+        Iterate over the queued stanzas, in the order they are sent.
+        """
+
+        return itertools.chain(*self.queues)
+
+    def depths(self):
+        """
+        Return the number of queued stanzas per priority.
+        """
+
+        return {NORMAL: len(self.queues[0]), LOW: len(self.queues[1])}
+
+    def _refill(self, now):
+        self.tokens = min(
+            self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def push(self, node, priority=NORMAL):
+        self.queues[priority - NORMAL].append(node)
+
+    def pop(self):
+        """
+        Return the next stanza to send, or None if the queues are empty or no
+        token is available.
+        """
+
+        now = time()
+        self._refill(now)
+
+        if self.tokens < 1:
+            return None
+
+        for queue in self.queues:
+            if queue:
+                node = queue.popleft()
+                break
+        else:
+            return None
+
+        self.tokens -= 1
+
+        # Track the stanza until it is acknowledged
+        msgid = node.get("id")
+
+        if msgid is not None:
+            self.sent[msgid] = now
+
+            if len(self.sent) > TRACK_SIZE:
+                self.sent.popitem(last=False)
+
+        return node
+
+    def delay(self):
+        """
+        Return the number of seconds until the next queued stanza can be
+        sent, or None if the queues are empty.
+        """
+
+        if not len(self):
+            return None
+
+        self._refill(time())
+        return max(0, (1 - self.tokens) / self.rate)
+
+    def acknowledged(self, msgid):
+        """
+        Register the acknowledgement of a sent stanza, e.g. a receipt or a
+        response.
+        """
+
+        sent = self.sent.pop(msgid, None)
+
+        if sent is None:
+            return
+
+        if time() - sent > SLOW_ACK:
+            self.backoff()
+        else:
+            self.rate = min(self.max_rate, self.rate + RATE_INCREASE)
+
+    def backoff(self):
+        """
+        Decrease the rate, e.g. when the server throttles.
+        """
+
+        self.rate = max(self.min_rate, self.rate * RATE_DECREASE)
+        self.backoffs += 1
+
+    def clear(self):
+        for queue in self.queues:
+            queue.clear()
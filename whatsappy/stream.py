@@ -1,10 +1,63 @@
-from whatsappy.tokens import str2tok, tok2str
+from whatsappy.tokens import TOKEN_INDEX, tok2str
 from whatsappy.node import Node
 from whatsappy.exceptions import StreamError
 
+from binascii import unhexlify
+from string import maketrans
+
+import struct
+
 ENCRYPTED_IN = 0x8
 ENCRYPTED_OUT = 0x1
 
+INT8 = struct.Struct(">B")
+INT16 = struct.Struct(">H")
+INT24 = struct.Struct(">BH")
+INT32 = struct.Struct(">I")
+
+# Protocol version sent before the first frame
+STREAM_HEADER = "WA\x01\x05"
+
+# Placeholders for the frame header and MAC, filled in after serializing.
+FRAME_HEADER = "\x00" * 3
+FRAME_MAC = "\x00" * 4
+
+
+def encode_token(token):
+    """
+    Encode a token. Tokens beyond the primary dictionary are escaped with 0xEC
+    and encoded as an index in the secondary dictionary.
+    """
+
+    if token <= 0xEB:
+        return chr(token)
+    elif 0xED <= token <= 0xED + 0xFF:
+        return "\xEC" + chr(token - 0xED)
+    else:
+        raise ValueError("Token cannot be encoded: %d" % token)
+
+
+# Encoded form of every token string, built once.
+TOKEN_BYTES = dict(
+    (string, encode_token(token)) for string, token in TOKEN_INDEX.iteritems())
+
+# Characters that can be packed into nibbles, e.g. numbers and timestamps. The
+# nibble 0xF pads strings of odd length.
+NIBBLES = "0123456789-."
+NIBBLE_MAX = 0x7F * 2
+
+
+def decode_nibble(nibble):
+    return str(nibble) if nibble < 10 else chr(nibble - 10 + 45)
+
+
+# Two characters for every byte. Encoding maps every character to the hex
+# digit of its nibble, so the string can be packed by unhexlify.
+NIBBLE_DECODE = [
+    decode_nibble(byte >> 4) + decode_nibble(byte & 0x0F)
+    for byte in xrange(256)]
+NIBBLE_ENCODE = maketrans(NIBBLES, "0123456789ab")
+
 
 class MessageIncomplete(Exception):
     """
@@ -22,307 +75,598 @@ class EndOfStream(Exception):
 
 class Reader(object):
     """
+    Incremental reader for the binary stream. Received data is appended to a
+    single growable buffer and consumed by advancing a read offset, so parsing
+    is linear in the number of bytes received. Complete frames are handed to a
+    Decoder.
     """
 
     def __init__(self):
-        self.buf = bytes()
+        self.buf = bytearray()
         self.offset = 0
         self.decrypt = None
 
-    def data(self, buf):
-        self.buf += buf
-
-    def _consume(self, size):
-        if size > len(self.buf):
-            raise StreamError("Not enough bytes available")
+        # Decrypted data of the next frame, if peeked at but not read yet
+        self.peeked = None
 
-        self.offset += size
+    def data(self, buf):
+        # Discard consumed bytes only once they outweigh the unread bytes.
+        # This keeps the amortized cost of compacting linear.
+        if self.offset and self.offset >= len(self.buf) - self.offset:
+            del self.buf[:self.offset]
+            self.offset = 0
 
-        data = self.buf[:size]
-        self.buf = self.buf[size:]
-        return data
+        self.buf.extend(buf)
 
-    def _peek(self, bytes):
-        return self.buf[:bytes]
+    def _frame(self):
+        """
+        Consume the next complete frame, and return its flags and the start
+        and end offset of its data.
+        """
 
-    def read(self):
-        if len(self.buf) <= 2:
+        if len(self.buf) - self.offset < 3:
             raise MessageIncomplete()
 
-        # Read stanza, but don't consume yet
-        buf = self.peek_int24()
+        # Read stanza header, but don't consume yet
+        buf = INT24.unpack_from(self.buf, self.offset)
+        buf = buf[0] << 16 | buf[1]
 
         flags = ((buf >> 16) & 0xF0) >> 4
         length = (buf & 0xFFFF) | (((buf >> 16) & 0x0F) << 16)
 
-        if length > len(self.buf):
+        start = self.offset + 3
+        end = start + length
+
+        if end > len(self.buf):
             raise MessageIncomplete()
 
-        # Process message. At this point, the message is complete, but the
-        # first three bytes should be consumed.
-        self.int24()
+        # At this point, the message is complete and can be consumed.
+        self.offset = end
+
+        return flags, start, end
+
+    def _next(self):
+        """
+        Consume the next complete frame, and return a tuple of the buffer with
+        its plain data, and the start and end offset of the data. Only plain
+        frames are decoded from the receive buffer itself.
+        """
+
+        if self.peeked is not None:
+            plain, self.peeked = self.peeked, None
+            return plain, 0, len(plain)
+
+        flags, start, end = self._frame()
 
         if flags & ENCRYPTED_IN:
-            return self._read_encrypted(length)
-        else:
-            plain = self.buf[:length]
-            return self._read(), plain
+            plain = self.decrypt(memoryview(self.buf)[start:end])
+            return plain, 0, len(plain)
+
+        return self.buf, start, end
+
+    def peek(self):
+        """
+        Return the root element of the next frame, with its attributes but
+        without data or children, and leave the frame to be read.
 
-    def _read_encrypted(self, length):
-        message_buf = self._consume(length)
-        message_buf = self.decrypt(message_buf)
+        Encrypted frames can only be decrypted once, so their decrypted data is
+        kept until the frame is read.
+        """
+
+        if self.peeked is not None:
+            return Decoder(self.peeked).header()
 
-        buf = self.buf
         offset = self.offset
+        buf, start, end = self._next()
+
+        if buf is self.buf:
+            self.offset = offset
+        else:
+            self.peeked = buf
+
+        return Decoder(buf, start, end).header()
+
+    def read(self, copy_plain=False, stream=None):
+        """
+        Consume the next frame, and return a tuple of the decoded node and the
+        plain data of the frame. Plain frames are decoded from the buffer, and
+        their data is only copied if 'copy_plain' is True. Otherwise, None is
+        returned instead.
+
+        If 'stream' is given, it should be a tuple of element names and a
+        callback. The children of these elements are then passed to the
+        callback with their parent while decoding, instead of being added.
+        """
+
+        buf, start, end = self._next()
+
+        if buf is not self.buf:
+            plain = buf
+        else:
+            plain = bytes(self.buf[start:end]) if copy_plain else None
+
+        decoder = Decoder(buf, start, end)
+
+        if stream is None:
+            return decoder.decode(), plain
+        return decoder.decode_stream(*stream), plain
+
+    def iter_children(self, name, tag=None):
+        """
+        Consume the next frame, and return an iterator over the children of
+        the elements with the given name, see Decoder.iter_children.
+
+        If 'tag' is given, the frame is only consumed if its root element has
+        that tag. Otherwise, the iterator is empty, and the frame is left to be
+        read. Use peek to decide for yourself.
+
+        The frame has to be complete, since the MAC covers the whole frame, but
+        the children are decoded one by one while iterating.
+        """
+
+        if tag is not None and self.peek().name != tag:
+            return iter(())
+
+        buf, start, end = self._next()
+
+        # Decode a copy, so the buffer can grow while the iterator is alive
+        if buf is self.buf:
+            buf, start, end = bytes(buf[start:end]), 0, None
+
+        return Decoder(buf, start, end).iter_children(name)
+
+
+class Decoder(object):
+    """
+    Decoder for a single frame. The frame is walked with a local cursor that
+    is passed between methods, and only leaf strings are copied out of the
+    buffer.
+
+    Every method takes the current position and returns a tuple of the decoded
+    value and the new position.
+    """
+
+    def __init__(self, buf, start=0, end=None):
+        self.buf = buf
+        self.view = memoryview(buf)
+        self.start = start
+        self.end = len(buf) if end is None else end
+
+    def decode(self):
+        """
+        Decode the frame into a node.
+        """
 
         try:
-            self.buf = message_buf
-            self.offset = 0
+            return self.node(self.start)[0]
+        finally:
+            # A live view prevents the underlying buffer from being resized,
+            # so it should not outlive decoding, e.g. via a traceback.
+            self.view = None
+
+    def header(self):
+        """
+        Decode the tag and attributes of the root element only, into a node
+        without data or children.
+        """
 
-            return self._read(), message_buf
+        try:
+            length, pos = self.list_start(self.start)
+            token, _ = self.int8(pos)
+
+            # Stream start and end consist of a header only
+            if token == 0x01 or token == 0x02:
+                return self.node(self.start)[0]
+
+            tag, pos = self.string(pos)
+            attributes, pos = self.attributes(pos, length)
+
+            node = Node(tag)
+            node._attributes = attributes or None
+
+            return node
         finally:
-            self.buf = buf
-            self.offset = offset
+            self.view = None
+
+    def decode_stream(self, names, callback):
+        """
+        Decode the frame into a node, like decode, but call 'callback' with the
+        element and the child for every child of an element with one of the
+        given names, instead of adding the child.
+        """
+
+        try:
+            if self._stream_header():
+                return self.node(self.start)[0]
+
+            root = Node(None)
+
+            for parent, child in self._walk(self.start, names, root):
+                callback(parent, child)
+
+            return root.children[0]
+        finally:
+            self.view = None
+
+    def iter_children(self, name):
+        """
+        Decode the frame incrementally, and yield a tuple of the root node and
+        a child, for every child of an element with the given name, or one of
+        the given names. Such elements are added to their parent without
+        children, so the root node only contains what has been decoded so far.
+        Other elements are decoded completely.
+
+        This avoids building the complete tree for large frames, such as sync
+        results with thousands of users.
+        """
+
+        try:
+            # Stream start and end do not have children
+            if self._stream_header():
+                self.node(self.start)
+                return
+
+            if isinstance(name, basestring):
+                name = (name, )
+
+            root = Node(None)
+
+            for _, child in self._walk(self.start, name, root):
+                yield root.children[0], child
+        finally:
+            self.view = None
+
+    def _stream_header(self):
+        """
+        Return True if the frame is a stream start or end.
+        """
+
+        length, pos = self.list_start(self.start)
+        token, _ = self.int8(pos)
+
+        return token == 0x01 or token == 0x02
+
+    def _walk(self, pos, names, parent):
+        """
+        Decode the node at 'pos' and add it to 'parent'. For elements with one
+        of the given names, yield a tuple of the element and each child instead
+        of adding the child. The position after the node is stored in
+        'self.pos'.
+        """
 
-    def _read(self):
-        length = self.list_start()
-        token = self.peek_int8()
+        length, pos = self.list_start(pos)
+        tag, pos = self.string(pos)
+        attributes, pos = self.attributes(pos, length)
+
+        node = Node(tag)
+        node._attributes = attributes or None
+        parent.add(node)
+
+        if (length % 2) == 0:
+            token, _ = self.int8(pos)
+
+            if token == 0xF8 or token == 0xF9:
+                count, pos = self.list_start(pos)
+
+                for _ in xrange(count):
+                    if tag in names:
+                        child, pos = self.node(pos)
+                        yield node, child
+                    else:
+                        for item in self._walk(pos, names, node):
+                            yield item
+                        pos = self.pos
+            else:
+                node.data, pos = self.string(pos)
+
+        self.pos = pos
+
+    def node(self, pos):
+        length, pos = self.list_start(pos)
+        token, _ = self.int8(pos)
 
         if token == 0x01:
-            self._consume(1)
-            attributes = self.attributes(length)
-            return Node("start", **attributes)
+            attributes, pos = self.attributes(pos + 1, length)
+
+            node = Node("start")
+            node._attributes = attributes or None
+            return node, pos
         elif token == 0x02:
-            self._consume(1)
             raise EndOfStream()
 
-        node = Node(self.string())
-        node.attributes = self.attributes(length)
+        name, pos = self.string(pos)
+        attributes, pos = self.attributes(pos, length)
+        data = children = None
 
         if (length % 2) == 0:
-            token = self.peek_int8()
+            token, _ = self.int8(pos)
 
-            if token == 0xf8 or token == 0xf9:
-                node.children = self.list()
+            if token == 0xF8 or token == 0xF9:
+                children, pos = self.list(pos)
             else:
-                node.data = self.string()
+                data, pos = self.string(pos)
 
-        return node
+        # Attribute names come from the wire, and may equal the names of
+        # arguments of Node, so they are not passed as keyword arguments
+        node = Node(name, data, children)
+        node._attributes = attributes or None
 
-    def peek_int8(self):
-        return ord(self._peek(1))
+        return node, pos
 
-    def peek_int16(self):
-        s = self._peek(2)
-        return ord(s[0]) << 8 | ord(s[1])
+    def int8(self, pos):
+        if pos + 1 > self.end:
+            raise StreamError("Not enough bytes available")
+        return INT8.unpack_from(self.buf, pos)[0], pos + 1
 
-    def peek_int24(self):
-        s = self._peek(3)
-        return ord(s[0]) << 16 | ord(s[1]) << 8 | ord(s[2])
+    def int16(self, pos):
+        if pos + 2 > self.end:
+            raise StreamError("Not enough bytes available")
+        return INT16.unpack_from(self.buf, pos)[0], pos + 2
 
-    def int8(self):
-        return ord(self._consume(1))
+    def int24(self, pos):
+        if pos + 3 > self.end:
+            raise StreamError("Not enough bytes available")
+        high, low = INT24.unpack_from(self.buf, pos)
+        return high << 16 | low, pos + 3
 
-    def int16(self):
-        s = self._consume(2)
-        return ord(s[0]) << 8 | ord(s[1])
+    def bytes(self, pos, size):
+        end = pos + size
 
-    def int24(self):
-        s = self._consume(3)
-        return ord(s[0]) << 16 | ord(s[1]) << 8 | ord(s[2])
+        if end > self.end:
+            raise StreamError("Not enough bytes available")
+        return self.view[pos:end].tobytes(), end
 
-    def list(self):
+    def list(self, pos):
+        length, pos = self.list_start(pos)
         children = []
-        for i in range(self.list_start()):
-            children.append(self._read())
-        return children
 
-    def list_start(self):
-        token = self.int8()
+        for _ in xrange(length):
+            child, pos = self.node(pos)
+            children.append(child)
+        return children, pos
+
+    def list_start(self, pos):
+        token, pos = self.int8(pos)
 
         if token == 0x00:
-            return 0
+            return 0, pos
         elif token == 0xF8:
-            return self.int8()
+            return self.int8(pos)
         elif token == 0xF9:
-            return self.int16()
+            return self.int16(pos)
         else:
-            raise ValueError("Unknown list start token: %02x" % ord(token))
+            raise ValueError("Unknown list start token: %02x" % token)
 
-    def attributes(self, length):
+    def attributes(self, pos, length):
         attributes = {}
 
-        for _ in range((length - 1) / 2):
-            name = self.string()
-            value = self.string()
+        for _ in xrange((length - 1) / 2):
+            name, pos = self.string(pos)
+            value, pos = self.string(pos)
             attributes[name] = value
-        return attributes
+        return attributes, pos
 
-    def string(self):
-        token = self.int8()
+    def string(self, pos):
+        token, pos = self.int8(pos)
 
         if token == 0x00:
-            return ""
-        elif 0x02 < token < 0xf5:
-            if token == 0xec:
-                return tok2str(0xed + self.int8())
+            return "", pos
+        elif 0x02 < token < 0xF5:
+            if token == 0xEC:
+                token, pos = self.int8(pos)
+                return tok2str(0xED + token), pos
             else:
-                return tok2str(token)
+                return tok2str(token), pos
         elif token == 0xFA:
-            user = self.string()
-            server = self.string()
-            return user + "@" + server
+            user, pos = self.string(pos)
+            server, pos = self.string(pos)
+            return user + "@" + server, pos
         elif token == 0xFC:
-            return self._consume(self.int8())
+            size, pos = self.int8(pos)
+            return self.bytes(pos, size)
         elif token == 0xFD:
-            return self._consume(self.int24())
+            size, pos = self.int24(pos)
+            return self.bytes(pos, size)
         elif token == 0xFE:
-            return tok2str(0xF5 + self.int8())
+            token, pos = self.int8(pos)
+            return tok2str(0xF5 + token), pos
         elif token == 0xFF:
-            nibble = self.int8()
-            ignore_last_nibble = nibble & 0x80
-            size = nibble & 0x7f
-            nibbles_count = size * 2 - (1 if ignore_last_nibble else 0)
-
-            data = self._consume(size)
-            output = ""
+            nibble, pos = self.int8(pos)
+            data, pos = self.bytes(pos, nibble & 0x7F)
+            output = "".join([NIBBLE_DECODE[byte] for byte in bytearray(data)])
 
-            for i in xrange(nibbles_count):
-                shift = 4 * (1 - i % 2)
-                decimal = (ord(data[i // 2]) & (15 << shift)) >> shift
+            # The last nibble is padding for strings of odd length
+            if nibble & 0x80:
+                output = output[:-1]
 
-                if decimal < 10:
-                    output += str(decimal)
-                else:
-                    output += chr(decimal - 10 + 45)
-
-            return output
+            return output, pos
         else:
-            raise ValueError("Unknown string token: %02x" % ord(token))
+            raise ValueError("Unknown string token: %02x" % token)
 
 
 class Writer(object):
     """
+    Writer for the binary stream. A node tree is first flattened into a list
+    of encoded pieces, most of which are shared token strings. The frame is
+    then assembled in one preallocated buffer of the exact size, with room for
+    the frame header and MAC. Encryption operates on that buffer in place.
+
+    The 'encrypt' attribute should be a callable that accepts a buffer, and
+    the start and end offset of the data to encrypt. It should encrypt the
+    data in place, and write a MAC of MAC_SIZE bytes directly after it.
     """
 
+    MAC_SIZE = 4
+
     def __init__(self):
         self.encrypt = None
 
     def start_stream(self, domain, resource):
+        """
+        Serialize the stream header, followed by the stream start frame.
+        """
+
         attributes = {"to": domain, "resource": resource}
 
         # Version 1.5
-        buf = "WA\x01\x05\x00\x00\x17"
+        out = [STREAM_HEADER, FRAME_HEADER]
+
+        self.list_start(out, len(attributes) * 2 + 1)
+        out.append("\x01")
+        self.attributes(out, attributes)
 
-        buf += self.list_start(len(attributes) * 2 + 1)
-        buf += "\x01"
-        buf += self.attributes(attributes)
+        buf = bytearray().join(out)
+        length = len(buf) - len(STREAM_HEADER) - len(FRAME_HEADER)
+
+        INT24.pack_into(
+            buf, len(STREAM_HEADER), length >> 16, length & 0xFFFF)
 
         return buf
 
-    def node(self, node, encrypt=None):
-        if node is None:
-            buf = plain = "\x00"
-        else:
-            buf = plain = self._node(node)
+    def node(self, node, encrypt=None, copy_plain=True):
+        """
+        Serialize a node into a frame, including the frame header. Returns a
+        tuple of the frame and the plain serialized node. If 'copy_plain' is
+        False, the latter is None, which saves a copy for encrypted frames.
+        """
 
         if encrypt is None:
             encrypt = self.encrypt is not None
 
+        # Reserve room for the header, and the MAC if encrypted
+        out = [FRAME_HEADER]
+
+        if node is None:
+            out.append("\x00")
+        else:
+            self._node(out, node)
+
         if encrypt:
-            buf = self.encrypt(buf)
+            out.append(FRAME_MAC)
 
-            first = (8 << 4) | ((len(buf) & 16711680) >> 16)
-            second = (len(buf) & 65280) >> 8
-            third = len(buf) & 255
+        buf = bytearray().join(out)
+        length = len(buf) - 3
+        size = length - self.MAC_SIZE if encrypt else length
 
-            header = self.int24((first << 16) | (second << 8) | third)
+        plain = bytes(buf[3:3 + size]) if copy_plain else None
+
+        if encrypt:
+            self.encrypt(buf, 3, 3 + size)
+            INT24.pack_into(buf, 0, (8 << 4) | (length >> 16), length & 0xFFFF)
         else:
-            header = self.int24(len(buf))
+            INT24.pack_into(buf, 0, length >> 16, length & 0xFFFF)
 
-        return header + buf, plain
+        return buf, plain
 
-    def _node(self, node):
-        length = 1
-        if node.attributes:
-            length += len(node.attributes) * 2
-        if node.children:
+    def _node(self, out, node):
+        if type(node) is Template:
+            out.append(node.encoded)
+            return
+
+        # Read the slot, so writing a leaf node does not allocate a list
+        children = node._children
+        length = 1 + len(node) * 2
+        if children:
             length += 1
         if node.data:
             length += 1
 
-        buf = self.list_start(length)
-        buf += self.string(node.name)
-        buf += self.attributes(node.attributes)
+        self.list_start(out, length)
+        self.string(out, node.name)
+        self.attributes(out, node)
 
         if node.data:
-            buf += self.bytes(node.data)
-
-        if node.children:
-            buf += self.list_start(len(node.children))
-            for child in node.children:
-                buf += self._node(child)
-
-        return buf
+            self.bytes(out, node.data)
 
-    def token(self, token):
-        if token < 0xF5:
-            return chr(token)
-        elif token <= 0x1F4:
-            return "\xFE" + chr(token - 0xF5)
+        if children:
+            self.list_start(out, len(children))
+            for child in children:
+                self._node(out, child)
 
-    def int8(self, value):
-        return chr(value & 0xFF)
+    def jid(self, out, user, server):
+        out.append("\xFA")
 
-    def int16(self, value):
-        return chr((value & 0xFF00) >> 8) + \
-            chr((value & 0x00FF) >> 0)
-
-    def int24(self, value):
-        return chr((value & 0xFF0000) >> 16) + \
-            chr((value & 0x00FF00) >> 8) + \
-            chr((value & 0x0000FF) >> 0)
+        if user:
+            self.string(out, user)
+        else:
+            out.append("\x00")
 
-    def jid(self, user, server):
-        buf = "\xFA"
-        buf += self.string(user) if user else "\x00"
-        buf += self.string(server)
-        return buf
+        self.string(out, server)
 
-    def bytes(self, string):
+    def bytes(self, out, string):
         if isinstance(string, unicode):
             string = string.encode("utf-8")
-        if len(string) > 0xFF:
-            leader = "\xFD" + self.int24(len(string))
+
+        length = len(string)
+
+        if length > 0xFF:
+            out.append(INT32.pack(0xFD000000 | length))
         else:
-            leader = "\xFC" + self.int8(len(string))
-        return leader + string
+            out.append("\xFC")
+            out.append(chr(length))
+
+        out.append(string)
+
+    def nibbles(self, out, string):
+        length = len(string)
+
+        out.append("\xFF")
+        out.append(chr((length + 1) // 2 | (0x80 if length % 2 else 0)))
+        out.append(unhexlify(
+            string.translate(NIBBLE_ENCODE) + ("f" if length % 2 else "")))
 
-    def string(self, string):
-        token = str2tok(string)
+    def string(self, out, string):
+        token = TOKEN_BYTES.get(string)
 
         if token is not None:
-            if token > 0xEB:
-                return self.token(0xEC) + self.token(token - 0xED)
-            else:
-                return self.token(token)
+            out.append(token)
         elif "@" in string:
             user, at, server = string.partition("@")
-            return self.jid(user, server)
+            self.jid(out, user, server)
+        elif type(string) is str and len(string) <= NIBBLE_MAX and \
+                not string.translate(None, NIBBLES):
+            self.nibbles(out, string)
         else:
-            return self.bytes(string)
+            self.bytes(out, string)
 
-    def attributes(self, attributes):
-        buf = bytes()
-        for key, value in attributes.iteritems():
-            buf += self.string(key)
-            buf += self.string(value)
-        return buf
+    def attributes(self, out, attributes):
+        for key, value in attributes.items():
+            self.string(out, key)
+            self.string(out, value)
 
-    def list_start(self, length):
+    def list_start(self, out, length):
         if length == 0:
-            return "\x00"
+            out.append("\x00")
         elif length <= 0xFF:
-            return "\xF8" + chr(length)
+            out.append("\xF8")
+            out.append(chr(length))
         else:
-            return "\xF9" + self.int16(length)
+            out.append("\xF9")
+            out.append(INT16.pack(length))
+
+
+class Template(Node):
+    """
+    Node that is serialized once, when it is constructed. The Writer copies
+    the serialized form, so templates save encoding constant parts of stanzas
+    over and over again. Templates should not be modified.
+    """
+
+    __slots__ = ("encoded", )
+
+    def __init__(self, node):
+        super(Template, self).__init__(
+            node.name, node.data, list(node.iter_children()))
+        self._attributes = dict(node.items()) or None
+
+        out = []
+        Writer()._node(out, node)
+
+        self.encoded = "".join(out)
+
+    def __getstate__(self):
+        return super(Template, self).__getstate__() + (self.encoded, )
+
+    def __setstate__(self, state):
+        super(Template, self).__setstate__(state[:-1])
+        self.encoded = state[-1]
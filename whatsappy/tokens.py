@@ -468,13 +468,22 @@ TOKENS += [
 ]
 
 
+# Reverse index of the token list, built once. Duplicate entries map to their
+# first occurrence.
+TOKEN_INDEX = {}
+
+for index, token in enumerate(TOKENS):
+    TOKEN_INDEX.setdefault(token, index)
+
+del index, token
+
+
 def str2tok(string):
     """
     Convert a string to a token. Returns None if the string is not a token.
     """
 
-    if string in TOKENS:
-        return TOKENS.index(string)
+    return TOKEN_INDEX.get(string)
 
 
 def tok2str(index):
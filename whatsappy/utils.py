@@ -1,6 +1,7 @@
 import time
 
 def dump_bytes(buf, prefix):
+    buf = bytes(buf)
     output = []
 
     for i in xrange(0, len(buf), 16):
@@ -30,4 +31,28 @@ def dump_xml(node, prefix):
     return "\n".join(output)
 
 def timestamp():
-    return str(int(time.time()))
\ No newline at end of file
+    return str(int(time.time()))
+
+
+def normalize_numbers(numbers):
+    """
+    Return the numbers in international format with a leading plus, in order
+    and without duplicates. Every character other than a digit is removed,
+    such as spaces, dashes, parentheses and a leading plus, and so is a leading
+    00 international prefix.
+    """
+
+    seen = set()
+    output = []
+
+    for number in numbers:
+        number = "".join(c for c in number if c.isdigit())
+
+        if number.startswith("00"):
+            number = number[2:]
+
+        if number and number not in seen:
+            seen.add(number)
+            output.append("+" + number)
+
+    return output